@@ -0,0 +1,19 @@
+# gunicorn 配置: gunicorn -c gunicorn.conf.py main:app
+from marknote.config import get_server_config
+
+_cfg = get_server_config()
+
+bind = f"{_cfg['host']}:{_cfg['port']}"
+workers = _cfg["workers"]
+worker_class = "marknote.server.UvicornWorker"
+keepalive = _cfg["keep_alive"]
+backlog = _cfg["backlog"]
+timeout = _cfg["timeout"]
+graceful_timeout = _cfg["graceful_timeout"]
+preload_app = _cfg["preload"]
+
+def on_starting(server):
+    # PRELOAD_APP=true 时在 fork 前预加载重量级依赖，worker 共享已加载的内存页
+    if preload_app:
+        from marknote.lifecycle import preload
+        preload()
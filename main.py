@@ -1,44 +1,40 @@
 import logging
-from logging.handlers import TimedRotatingFileHandler
-import os
-from datetime import datetime
 from fastapi import FastAPI
 from marknote.mark_note import router as marknote_router
 from marknote.full_text import router as full_text_router
 from marknote.extension import router as extension_router
 from marknote.images import router as image_router
+from marknote.transcript import router as transcript_router
+from marknote.live import router as live_router
+from marknote.usage import router as usage_router
+from marknote.lifecycle import lifespan, router as lifecycle_router
+from marknote.admission import AdmissionMiddleware
+from marknote.profiling import ProfilingMiddleware
+from marknote.admin import router as admin_router
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 
 
-# 日志配置
-log_dir = os.path.join(os.path.dirname(__file__), "logs")
-os.makedirs(log_dir, exist_ok=True)
-log_time = datetime.now().strftime("%Y%m%d%H")
-log_file = os.path.join(log_dir, f"marknote-{log_time}.log")
-
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-handler = TimedRotatingFileHandler(log_file, when="H", interval=1, backupCount=168, encoding="utf-8")
-formatter = logging.Formatter("[%(asctime)s][%(levelname)s][%(filename)s:%(lineno)d]: %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
-handler.setFormatter(formatter)
-if not logger.hasHandlers():
-    logger.addHandler(handler)
-else:
-    logger.handlers.clear()
-    logger.addHandler(handler)
-
 app = FastAPI(
     title="MarkNote Summary API",
     description="MarkNote 项目 API 文档，支持会议内容、图片、笔记等多模态总结能力。",
     version="1.0.0",
     docs_url="/swagger",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 app.include_router(marknote_router)
 app.include_router(full_text_router)
 app.include_router(extension_router)
 app.include_router(image_router)
+app.include_router(transcript_router)
+app.include_router(live_router)
+app.include_router(usage_router)
+app.include_router(lifecycle_router)
+app.include_router(admin_router)
+# 剖析只覆盖已准入的请求，排队时间不计入
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(AdmissionMiddleware)
 
 @app.get("/")
 def read_root():
@@ -46,13 +42,12 @@ def read_root():
     return {"message": "Hello, FastAPI with MarkNote!"}
 
 # 挂载静态文件目录
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", StaticFiles(directory="static", check_dir=False), name="static")
 
 @app.get("/favicon.ico")
 def favicon():
     return FileResponse("static/favicon.ico")
 
 if __name__ == "__main__":
-    import uvicorn
-    logging.info("Starting FastAPI app on 0.0.0.0:8080")
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    from marknote.server import main
+    main()
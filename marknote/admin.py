@@ -0,0 +1,89 @@
+import os
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import FileResponse
+from pydantic import BaseModel, Field
+from marknote.admission import get_admission_controller
+from marknote.config import get_prompt_config, reload_llm_config
+from marknote.database.mysql_client import insert_prompt_template
+from marknote.profiling import list_profiles, load_profile, profile_file
+from marknote.prompts import PROMPT_NAME, REQUIRED_PLACEHOLDERS, PromptTemplate, get_prompt_registry, reload_prompts
+
+def require_admin(x_admin_token: str = Header(None)):
+    """管理接口需要携带与 ADMIN_TOKEN 一致的 X-Admin-Token 请求头; 未设置 ADMIN_TOKEN 时管理接口不可用"""
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPException(status_code=403, detail="Admin API is disabled, set ADMIN_TOKEN")
+    if x_admin_token != admin_token:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+@router.get("/admission")
+def admission_stats():
+    """各类接口的并发数、队列深度、准入与拒绝计数"""
+    return get_admission_controller().stats()
+
+@router.post("/llm_config/reload")
+def reload_llm_routes():
+    """立即重新加载 LLM 路由表(不等待修改时间检查)，返回生效的路由(不含 api_key)"""
+    try:
+        settings = reload_llm_config()
+    except Exception as e:
+        return {"error": f"Reload LLM config failed: {str(e)}"}
+    return {"model": settings["model"], "routes": settings["routes"]}
+
+class PromptCreateRequest(BaseModel):
+    name: str = Field(..., description="模板名")
+    template: str = Field(..., description="模板内容")
+    version: int = Field(None, description="版本号, 可选, 默认为当前最大版本 + 1")
+    kind: str = Field(None, description="用于校验占位符的接口类型: mark_summary, full_text, extension, image")
+
+@router.get("/prompts")
+def list_prompts():
+    """注册表中的全部模板(不含模板内容)"""
+    return {"prompts": get_prompt_registry().list()}
+
+@router.post("/prompts")
+def create_prompt(request: PromptCreateRequest):
+    """校验并保存模板到 prompt_template 表，随后重新加载注册表; PROMPT_DB_ENABLED=false 时不加载数据库模板，拒绝保存"""
+    if not get_prompt_config()["db_enabled"]:
+        raise HTTPException(status_code=409, detail="Prompt templates in MySQL are disabled, set PROMPT_DB_ENABLED=true")
+    if not PROMPT_NAME.fullmatch(request.name):
+        return {"error": f"Invalid prompt name: {request.name}"}
+    if request.kind is not None and request.kind not in REQUIRED_PLACEHOLDERS:
+        return {"error": f"Unknown prompt kind: {request.kind}"}
+    try:
+        PromptTemplate(request.template).validate(REQUIRED_PLACEHOLDERS.get(request.kind, ()))
+        version = insert_prompt_template(request.name, request.template, request.version)
+    except Exception as e:
+        return {"error": f"Save prompt failed: {str(e)}"}
+    try:
+        return reload_prompts().get(f"{request.name}:{version}").info()
+    except KeyError:
+        return {"error": f"Prompt {request.name}:{version} saved but not loaded, check the MySQL connection and reload"}
+
+@router.post("/prompts/reload")
+def reload_prompt_registry():
+    return {"prompts": reload_prompts().list()}
+
+@router.get("/profiles")
+def profiles():
+    """已保存的剖析结果列表，按时间倒序"""
+    return {"profiles": list_profiles()}
+
+@router.get("/profiles/{profile_id}")
+def profile_detail(profile_id: str):
+    """单次剖析的 CPU 文本报告和内存快照对比"""
+    try:
+        return load_profile(profile_id)
+    except (ValueError, FileNotFoundError) as e:
+        return {"error": str(e)}
+
+@router.get("/profiles/{profile_id}/download")
+def profile_download(profile_id: str):
+    """下载原始结果: cProfile 为 .prof(pstats 格式)，pyinstrument 为 .html"""
+    try:
+        path = profile_file(profile_id)
+    except (ValueError, FileNotFoundError) as e:
+        return {"error": str(e)}
+    return FileResponse(path, filename=os.path.basename(path))
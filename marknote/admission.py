@@ -0,0 +1,159 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+from fastapi.responses import JSONResponse
+from marknote.config import get_admission_config
+
+class AdmissionRejected(Exception):
+    def __init__(self, name: str, reason: str, retry_after: int):
+        super().__init__(f"{name}: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionClass:
+    """一类接口的并发上限、等待队列和统计"""
+    def __init__(self, name, limit, max_queue, queue_timeout, priority):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.priority = priority
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = 0
+
+class AdmissionController:
+    """
+    事件循环内的准入控制: 每类接口有独立的并发上限和有界等待队列，所有类共享 total_limit。
+    有空位时按 priority 从小到大唤醒等待者，同优先级先到先得；排队超过 queue_timeout 或队列已满时直接拒绝。
+    只在单个事件循环中使用，不需要加锁。
+    """
+    def __init__(self, total_limit: int, classes: dict):
+        self.total_limit = total_limit
+        self.in_flight = 0
+        self.classes = {name: AdmissionClass(name, **cfg) for name, cfg in classes.items()}
+        self._waiters = []
+        self._seq = itertools.count()
+
+    def _can_admit(self, cls: AdmissionClass) -> bool:
+        return self.in_flight < self.total_limit and cls.in_flight < cls.limit
+
+    def _admit(self, cls: AdmissionClass):
+        self.in_flight += 1
+        cls.in_flight += 1
+        cls.admitted += 1
+
+    def _reject(self, cls: AdmissionClass, reason: str):
+        cls.shed += 1
+        logging.warning(f"Admission rejected {cls.name}: {reason}, in_flight={cls.in_flight}, queued={cls.queued}")
+        raise AdmissionRejected(cls.name, reason, max(1, math.ceil(cls.queue_timeout)))
+
+    async def acquire(self, name: str):
+        cls = self.classes[name]
+        # 每次释放后都会唤醒所有可准入的等待者，因此此处可准入时不存在被插队的等待者
+        if self._can_admit(cls):
+            self._admit(cls)
+            return
+        if cls.queued >= cls.max_queue:
+            self._reject(cls, "queue full")
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (cls.priority, next(self._seq), fut, cls))
+        cls.queued += 1
+        try:
+            await asyncio.wait_for(fut, cls.queue_timeout)
+        except asyncio.TimeoutError:
+            # 3.12 起 release 与截止时间落在同一轮事件循环时，已被 _wake 准入的等待者仍会超时，此时按已准入处理
+            if fut.done() and not fut.cancelled():
+                return
+            fut.cancel()
+            cls.queued -= 1
+            self._reject(cls, "queue timeout")
+        except asyncio.CancelledError:
+            # 客户端断开: 已被唤醒则归还名额，否则只移出队列
+            if fut.done() and not fut.cancelled():
+                self.release(name)
+            else:
+                fut.cancel()
+                cls.queued -= 1
+            raise
+
+    def release(self, name: str):
+        cls = self.classes[name]
+        self.in_flight -= 1
+        cls.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        blocked = []
+        while self._waiters and self.in_flight < self.total_limit:
+            entry = heapq.heappop(self._waiters)
+            _, _, fut, cls = entry
+            if fut.done():
+                continue
+            if cls.in_flight >= cls.limit:
+                blocked.append(entry)
+                continue
+            cls.queued -= 1
+            self._admit(cls)
+            fut.set_result(None)
+        for entry in blocked:
+            heapq.heappush(self._waiters, entry)
+
+    def stats(self) -> dict:
+        return {
+            "total_limit": self.total_limit,
+            "in_flight": self.in_flight,
+            "classes": {
+                name: {
+                    "limit": cls.limit,
+                    "max_queue": cls.max_queue,
+                    "queue_timeout": cls.queue_timeout,
+                    "priority": cls.priority,
+                    "in_flight": cls.in_flight,
+                    "queued": cls.queued,
+                    "admitted": cls.admitted,
+                    "shed": cls.shed,
+                }
+                for name, cls in self.classes.items()
+            },
+        }
+
+_controller = None
+_routes = {}
+
+def get_admission_controller() -> AdmissionController:
+    global _controller, _routes
+    if _controller is None:
+        cfg = get_admission_config()
+        _routes = cfg["routes"] if cfg["enabled"] else {}
+        _controller = AdmissionController(cfg["total_limit"], cfg["classes"])
+    return _controller
+
+class AdmissionMiddleware:
+    """ASGI 中间件: 受控接口在进入线程池前先排队准入，超出预算时快速返回 503 + Retry-After"""
+    def __init__(self, app):
+        self.app = app
+        self.controller = get_admission_controller()
+
+    async def __call__(self, scope, receive, send):
+        name = _routes.get(scope.get("path")) if scope["type"] == "http" else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.controller.acquire(name)
+        except AdmissionRejected as e:
+            response = JSONResponse(
+                status_code=503,
+                content={"error": f"Service overloaded: {e.reason}"},
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(name)
@@ -1,7 +1,46 @@
 import logging
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from marknote.config import get_server_config
+from marknote.singleflight import SingleFlight, llm_call_key
+from marknote.usage import record_usage
+
+_http_session = None
+_http_session_lock = threading.Lock()
+# 并发的相同 LLM 调用(如客户端重试)只请求一次上游
+_llm_flight = SingleFlight()
+
+def get_http_session() -> requests.Session:
+    """返回进程内共享的 HTTP 会话，复用到 LLM 服务的连接池"""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                pool_size = get_server_config()["http_pool_size"]
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _http_session = session
+    return _http_session
+
+def close_http_session():
+    global _http_session
+    with _http_session_lock:
+        if _http_session is not None:
+            _http_session.close()
+            _http_session = None
 
 def call_llm_api(prompt: str, image_url: list, model: str, api_key: str, api_url: str) -> str:
+    key = llm_call_key(prompt, image_url, model, api_url)
+    (content, usage), shared = _llm_flight.do_shared(key, lambda: _post_llm_api(prompt, image_url, model, api_key, api_url))
+    # token 只计入实际发起上游调用的请求，共享结果的请求只记一次 shared_calls，按 summary_id 汇总时不重复计费
+    record_usage(usage, shared=shared)
+    return content
+
+def _post_llm_api(prompt: str, image_url: list, model: str, api_key: str, api_url: str):
+    """请求 LLM 服务，返回 (content, usage)"""
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
@@ -29,9 +68,9 @@ def call_llm_api(prompt: str, image_url: list, model: str, api_key: str, api_url
     if image_url is None or (isinstance(image_url, list) and len(image_url) == 0):
         payload["messages"][0]["content"] = str(prompt)
     logging.info(f"Payload for LLM API: {payload}")
-    resp = requests.post(api_url, json=payload, headers=headers, timeout=60)
+    resp = get_http_session().post(api_url, json=payload, headers=headers, timeout=60)
     resp.raise_for_status()
     data = resp.json()
     if "choices" in data and data["choices"]:
-        return data["choices"][0]["message"]["content"]
-    return str(data)
+        return data["choices"][0]["message"]["content"], data.get("usage")
+    return str(data), data.get("usage")
@@ -0,0 +1,197 @@
+"""
+离线批量重新生成 mark_note_summary 中的摘要，用于上线新模板后回填历史会议。
+
+    python -m marknote.backfill --template MEETING_SUMMARY_PROMPT:4 --checkpoint backfill.json
+
+按 id 升序键集分页读取，prompt 在进程池中渲染，LLM 调用经有界并发池执行，
+结果按批回写并记录检查点，中断后以相同参数重新运行即可从检查点继续。
+失败的行记录在检查点的 failed_ids 中，正常续跑不会重复处理，加 --retry-failed 单独重跑这些行。
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from marknote.api import call_llm_api
+from marknote.config import get_llm_config
+from marknote.database.mysql_client import get_mark_note_summaries_by_ids, iter_mark_note_summaries, update_mark_note_summaries
+from marknote.images import extract_image_contents
+from marknote.mark_note import build_prompt, parse_image_urls
+from marknote.prompts import REQUIRED_PLACEHOLDERS, get_prompt
+
+def iter_failed_rows(failed_ids: list, batch_size: int):
+    """按批读取检查点中失败的行"""
+    ids = sorted(set(failed_ids))
+    for idx in range(0, len(ids), batch_size):
+        rows = get_mark_note_summaries_by_ids(ids[idx:idx + batch_size])
+        if rows:
+            yield rows
+
+def render_row(row: dict, template: str, image_content: list = None) -> str:
+    """在子进程中渲染单行的 prompt"""
+    return build_prompt(
+        {"prompt_template": template},
+        template,
+        row["content"] or "",
+        row["language"] or "",
+        image_content=image_content,
+        user_notes=row["user_notes"]
+    )
+
+class Checkpoint:
+    """
+    记录已完成(已回写或失败)的最大连续 id。并发处理时行的完成顺序不固定，
+    只有比它小的 id 都完成后才推进 last_id，保证从检查点恢复时不会漏行。
+    重跑 failed_ids 时这些 id 都小于 last_id，last_id 保持不变。
+    """
+    def __init__(self, path: str = None):
+        self.path = path
+        self.last_id = 0
+        self.processed = 0
+        self.failed_ids = []
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.last_id = data["last_id"]
+            self.processed = data["processed"]
+            self.failed_ids = data["failed_ids"]
+        self._dispatched = deque()
+        self._finished = set()
+
+    def dispatch(self, row_id: int):
+        self._dispatched.append(row_id)
+
+    def finish(self, row_ids: list):
+        self._finished.update(row_ids)
+        while self._dispatched and self._dispatched[0] in self._finished:
+            row_id = self._dispatched.popleft()
+            self._finished.discard(row_id)
+            self.last_id = max(self.last_id, row_id)
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"last_id": self.last_id, "processed": self.processed, "failed_ids": self.failed_ids}, f)
+        os.replace(tmp_path, self.path)
+
+async def run_backfill(args) -> Checkpoint:
+    template = get_prompt(args.template).text
+    checkpoint = Checkpoint(args.checkpoint)
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(args.concurrency)
+    results = []
+    started = time.monotonic()
+    last_report = started
+    processed = 0
+
+    async def flush():
+        batch = results[:]
+        results.clear()
+        if not batch:
+            return
+        checkpoint.processed += len(batch)
+        checkpoint.finish([row_id for _, _, row_id in batch])
+        if not args.dry_run:
+            await loop.run_in_executor(None, update_mark_note_summaries, batch)
+            checkpoint.save()
+
+    def report(final=False):
+        nonlocal last_report
+        now = time.monotonic()
+        if not final and now - last_report < args.report_interval:
+            return
+        last_report = now
+        elapsed = max(now - started, 1e-6)
+        logging.info(
+            f"Backfill progress: processed={processed}, failed={len(checkpoint.failed_ids)}, "
+            f"last_id={checkpoint.last_id}, throughput={processed / elapsed:.2f} rows/s"
+        )
+
+    mp_context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(args.processes, mp_context=mp_context) as render_pool, \
+            concurrent.futures.ThreadPoolExecutor(args.concurrency) as llm_pool:
+        async def process(row):
+            nonlocal processed
+            try:
+                image_content = None
+                if row["mark_type"] == "image" and row["image_url"]:
+                    items = await loop.run_in_executor(llm_pool, extract_image_contents, parse_image_urls(row["image_url"]), row["language"])
+                    image_content = [item["summary"] for item in items if "summary" in item]
+                prompt = await loop.run_in_executor(render_pool, render_row, row, template, image_content)
+                mark_note = None
+                if not args.dry_run:
+                    llm_cfg = get_llm_config("meeting", "mark_summary", text=prompt)
+                    mark_note = await loop.run_in_executor(
+                        llm_pool, call_llm_api, prompt, None, llm_cfg["model"], llm_cfg["api_key"], llm_cfg["api_url"]
+                    )
+                results.append((mark_note, prompt, row["id"]))
+            except Exception as e:
+                logging.error(f"Backfill failed for id={row['id']}: {str(e)}")
+                checkpoint.failed_ids.append(row["id"])
+                checkpoint.finish([row["id"]])
+            finally:
+                processed += 1
+                slots.release()
+
+        tasks = set()
+        if args.retry_failed:
+            # 只重跑上次失败的行，仍然失败的会重新记入 failed_ids
+            batches = iter_failed_rows(checkpoint.failed_ids, args.batch_size)
+            if not args.dry_run:
+                checkpoint.failed_ids = []
+        else:
+            batches = iter_mark_note_summaries(checkpoint.last_id, args.summary_id, args.limit, args.batch_size)
+        while True:
+            rows = await loop.run_in_executor(None, next, batches, None)
+            if rows is None:
+                break
+            for row in rows:
+                await slots.acquire()
+                checkpoint.dispatch(row["id"])
+                task = asyncio.create_task(process(row))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if len(results) >= args.batch_size:
+                    await flush()
+                report()
+        await asyncio.gather(*tasks)
+        await flush()
+        if not args.dry_run:
+            # 最后一批都失败时 flush 不会保存，failed_ids 在这里落盘
+            checkpoint.save()
+    report(final=True)
+    return checkpoint
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="批量重新生成 mark_note_summary 摘要")
+    parser.add_argument("--template", default="MEETING_SUMMARY_PROMPT:4", help="prompt 注册表中的模板ID(name 或 name:version)")
+    parser.add_argument("--summary-id", default=None, help="只处理指定 summary_id")
+    parser.add_argument("--limit", type=int, default=None, help="最多处理的行数")
+    parser.add_argument("--checkpoint", default=None, help="检查点文件路径，存在时从中断处继续")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="渲染 prompt 的进程数")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发 LLM 调用数")
+    parser.add_argument("--batch-size", type=int, default=200, help="读取与回写的批大小")
+    parser.add_argument("--report-interval", type=float, default=10, help="吞吐量日志间隔(秒)")
+    parser.add_argument("--dry-run", action="store_true", help="只渲染 prompt，不调用 LLM、不回写")
+    parser.add_argument("--retry-failed", action="store_true", help="只重新处理检查点 failed_ids 中的行")
+    args = parser.parse_args(argv)
+    try:
+        get_prompt(args.template, REQUIRED_PLACEHOLDERS["mark_summary"])
+    except (KeyError, ValueError) as e:
+        parser.error(f"Invalid template {args.template}: {e.args[0]}")
+    return args
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s][%(levelname)s]: %(message)s")
+    args = parse_args(argv)
+    checkpoint = asyncio.run(run_backfill(args))
+    logging.info(f"Backfill finished: last_id={checkpoint.last_id}, failed_ids={checkpoint.failed_ids}")
+
+if __name__ == "__main__":
+    main()
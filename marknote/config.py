@@ -1,5 +1,10 @@
+import json
+import logging
 import os
+import threading
+import time
 from .prompt_template import MEETING_SUMMARY_PROMPT_V4
+from .database.split import count_tokens
 from dotenv import load_dotenv
 
 # 在模块加载时自动加载.env
@@ -11,25 +16,240 @@ def get_aws_s3_config():
         "aws_access_key_id": os.getenv("AWS_ACCESS_KEY_ID"),
         "aws_secret_access_key": os.getenv("AWS_SECRET_ACCESS_KEY"),
         "region_name": os.getenv("AWS_REGION"),
+        "pool_size": int(os.getenv("S3_POOL_SIZE", 32)),
+        "presign_expires": int(os.getenv("S3_PRESIGN_EXPIRES", 3600)),
+        # presign: 预签名地址交给 LLM 拉取; inline: 本地缓存后内联为 base64
+        "delivery": os.getenv("S3_IMAGE_DELIVERY", "presign"),
+        "cache_dir": os.getenv("S3_CACHE_DIR", "/tmp/marknote-s3-cache"),
+        "cache_max_bytes": int(os.getenv("S3_CACHE_MAX_BYTES", 512 * 1024 * 1024)),
+        # 对象 ETag 的缓存时间，期间不再 head_object; 对象被覆盖后最多延迟这么久才识别为新图片
+        "etag_ttl": int(os.getenv("S3_ETAG_TTL", 300)),
     }
 
-def get_llm_config(scenario: str):
+def get_server_config():
+    return {
+        "host": os.getenv("HOST", "0.0.0.0"),
+        "port": int(os.getenv("PORT", 8080)),
+        "workers": int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        "keep_alive": int(os.getenv("KEEP_ALIVE", 5)),
+        "backlog": int(os.getenv("BACKLOG", 2048)),
+        "timeout": int(os.getenv("WORKER_TIMEOUT", 120)),
+        "graceful_timeout": int(os.getenv("GRACEFUL_TIMEOUT", 30)),
+        "threadpool_size": int(os.getenv("THREADPOOL_SIZE", 40)),
+        "http_pool_size": int(os.getenv("HTTP_POOL_SIZE", 32)),
+        "preload": os.getenv("PRELOAD_APP", "false").lower() in ("1", "true", "yes"),
+        # LOG_DIR 为空时只输出到 stderr，不写日志文件(测试时使用)
+        "log_dir": os.getenv("LOG_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "logs")),
+    }
+
+def get_admission_config():
     """
-    根据 scenario 返回 LLM 的 api_url、model、api_key、prompt_template
+    准入控制配置。priority 越小越优先; total_limit 为所有受控接口共享的并发上限，
+    默认比线程池小一些，给 / 等不受控的接口预留线程。
     """
-    api_url = os.getenv("LLM_API_URL", "https://api.openai.com/v1/chat/completions")
-    model = os.getenv("BASE_MODEL", "gpt-4o")
-    api_key = os.getenv("MODEL_API_KEY", "")
-    if scenario == "meeting":
-        return {
-            "api_url": api_url,
-            "model": model,
-            "api_key": api_key,
-            "prompt_template": MEETING_SUMMARY_PROMPT_V4,
+    threadpool_size = get_server_config()["threadpool_size"]
+    defaults = {
+        "summary": {"limit": 32, "max_queue": 64, "queue_timeout": 5, "priority": 0},
+        "extension": {"limit": 16, "max_queue": 32, "queue_timeout": 5, "priority": 1},
+        "image": {"limit": 8, "max_queue": 16, "queue_timeout": 10, "priority": 1},
+        "full_text": {"limit": 4, "max_queue": 8, "queue_timeout": 30, "priority": 2},
+    }
+    classes = {}
+    for name, cfg in defaults.items():
+        prefix = f"ADMISSION_{name.upper()}_"
+        classes[name] = {
+            "limit": int(os.getenv(prefix + "LIMIT", cfg["limit"])),
+            "max_queue": int(os.getenv(prefix + "QUEUE", cfg["max_queue"])),
+            "queue_timeout": float(os.getenv(prefix + "TIMEOUT", cfg["queue_timeout"])),
+            "priority": int(os.getenv(prefix + "PRIORITY", cfg["priority"])),
         }
     return {
-        "api_url": api_url,
-        "model": model,
-        "api_key": api_key,
+        "enabled": os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes"),
+        "total_limit": int(os.getenv("ADMISSION_TOTAL_LIMIT", max(threadpool_size - 4, 1))),
+        "classes": classes,
+        "routes": {
+            "/mark_note/summary": "summary",
+            "/mark_note/extension": "extension",
+            "/mark_note/extension/batch": "extension",
+            "/image/summary": "image",
+            "/mark_note/full_text": "full_text",
+        },
+    }
+
+def get_idempotency_config():
+    return {
+        "ttl": int(os.getenv("IDEMPOTENCY_TTL", 24 * 3600)),
+        "cache_size": int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 10000)),
+        # 结果同时保存到 MySQL，重试请求落到其他 worker 时也能命中
+        "db_enabled": os.getenv("IDEMPOTENCY_DB_ENABLED", "true").lower() in ("1", "true", "yes"),
+    }
+
+def get_image_config():
+    return {
+        "concurrency": int(os.getenv("IMAGE_CONCURRENCY", 8)),
+        "cache_size": int(os.getenv("IMAGE_CACHE_SIZE", 1024)),
+        "cache_ttl": int(os.getenv("IMAGE_CACHE_TTL", 7 * 24 * 3600)),
+    }
+
+def get_transcript_config():
+    return {
+        "store_dir": os.getenv("TRANSCRIPT_DIR", "/tmp/marknote-transcripts"),
+        "max_bytes": int(os.getenv("TRANSCRIPT_MAX_BYTES", 64 * 1024 * 1024)),
+        "ttl": int(os.getenv("TRANSCRIPT_TTL", 7 * 24 * 3600)),
+    }
+
+def get_extension_config():
+    return {
+        "max_notes": int(os.getenv("EXTENSION_BATCH_MAX_NOTES", 500)),
+        "pack_max_notes": int(os.getenv("EXTENSION_PACK_MAX_NOTES", 20)),
+        "pack_max_tokens": int(os.getenv("EXTENSION_PACK_MAX_TOKENS", 1000)),
+        "pack_note_max_tokens": int(os.getenv("EXTENSION_PACK_NOTE_MAX_TOKENS", 200)),
+        "concurrency": int(os.getenv("EXTENSION_CONCURRENCY", 8)),
+    }
+
+def get_live_config():
+    return {
+        "enabled": os.getenv("LIVE_PRESUMMARIZE", "false").lower() in ("1", "true", "yes"),
+        "window": int(os.getenv("LIVE_WINDOW_SECONDS", 60)),
+        "stride": int(os.getenv("LIVE_WINDOW_STRIDE", 30)),
+        "retain": int(os.getenv("LIVE_RETAIN_SECONDS", 600)),
+        "max_windows": int(os.getenv("LIVE_MAX_WINDOWS", 240)),
+        "max_sessions": int(os.getenv("LIVE_MAX_SESSIONS", 256)),
+        "session_ttl": int(os.getenv("LIVE_SESSION_TTL", 4 * 3600)),
+        "concurrency": int(os.getenv("LIVE_CONCURRENCY", 4)),
+    }
+
+def get_profile_config():
+    return {
+        "enabled": os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes"),
+        "sample_rate": float(os.getenv("PROFILE_SAMPLE_RATE", 0)),
+        "memory": os.getenv("PROFILE_MEMORY", "false").lower() in ("1", "true", "yes"),
+        "dir": os.getenv("PROFILE_DIR", "/tmp/marknote-profiles"),
+        "max_files": int(os.getenv("PROFILE_MAX_FILES", 50)),
+        "top": int(os.getenv("PROFILE_TOP", 40)),
+    }
+
+def get_prompt_config():
+    return {
+        "dir": os.getenv("PROMPT_DIR", "prompts"),
+        "db_enabled": os.getenv("PROMPT_DB_ENABLED", "true").lower() in ("1", "true", "yes"),
+        "refresh_interval": float(os.getenv("PROMPT_REFRESH_INTERVAL", 300)),
+        "cache_size": int(os.getenv("PROMPT_CACHE_SIZE", 256)),
+    }
+
+# LLM 调用点: 标记摘要、全文分段摘要、分段+笔记合并、全文最终汇总、笔记扩写、图片提取
+LLM_SITES = ("mark_summary", "segment", "merge", "final", "extension", "image")
+
+_llm_settings = None
+_llm_settings_lock = threading.Lock()
+_llm_settings_checked_at = 0.0
+
+def default_llm_routes(fast_model: str, small_window_tokens: int) -> list:
+    """默认路由: map 阶段和短窗口的标记摘要使用更快的模型，其余使用 BASE_MODEL"""
+    return [
+        {"site": "segment", "model": fast_model},
+        {"site": "merge", "model": fast_model},
+        {"site": "mark_summary", "max_tokens": small_window_tokens, "model": fast_model},
+    ]
+
+def load_llm_settings() -> dict:
+    """
+    读取 LLM 基础配置和路由表。路由表可由 LLM_ROUTING_FILE 指定 JSON 文件:
+    {"routes": [{"site": "segment", "scenario": "meeting", "min_tokens": 0, "max_tokens": 8000,
+                 "model": "gpt-4o-mini", "api_url": "...", "api_key_env": "..."}]}
+    按顺序匹配，第一条 site/scenario/token 范围都满足的规则生效，未匹配时使用 BASE_MODEL。
+    """
+    settings = {
+        "api_url": os.getenv("LLM_API_URL", "https://api.openai.com/v1/chat/completions"),
+        "model": os.getenv("BASE_MODEL", "gpt-4o"),
+        "api_key": os.getenv("MODEL_API_KEY", ""),
+        "routes": default_llm_routes(os.getenv("FAST_MODEL", "gpt-4o-mini"), int(os.getenv("SMALL_WINDOW_TOKENS", 2000))),
+        "routing_file": os.getenv("LLM_ROUTING_FILE"),
+        "routing_mtime": None,
+    }
+    if settings["routing_file"] and os.path.exists(settings["routing_file"]):
+        with open(settings["routing_file"], encoding="utf-8") as f:
+            settings["routes"] = json.load(f).get("routes", [])
+        settings["routing_mtime"] = os.path.getmtime(settings["routing_file"])
+    for route in settings["routes"]:
+        if route.get("site") not in LLM_SITES:
+            raise ValueError(f"Unknown LLM route site: {route.get('site')}")
+    return settings
+
+def reload_llm_config() -> dict:
+    global _llm_settings
+    settings = load_llm_settings()
+    with _llm_settings_lock:
+        _llm_settings = settings
+    return settings
+
+def get_llm_settings() -> dict:
+    """
+    返回已加载的 LLM 配置，进程内只解析一次。
+    路由文件每 LLM_CONFIG_CHECK_INTERVAL 秒检查一次修改时间，变化时自动重新加载。
+    """
+    global _llm_settings_checked_at
+    settings = _llm_settings
+    if settings is None:
+        return reload_llm_config()
+    now = time.monotonic()
+    if settings["routing_file"] and now - _llm_settings_checked_at > float(os.getenv("LLM_CONFIG_CHECK_INTERVAL", 5)):
+        _llm_settings_checked_at = now
+        try:
+            mtime = os.path.getmtime(settings["routing_file"])
+        except OSError:
+            mtime = None
+        if mtime != settings["routing_mtime"]:
+            try:
+                return reload_llm_config()
+            except Exception as e:
+                logging.error(f"Reload LLM routing file failed, keep previous config: {str(e)}")
+    return settings
+
+def _count_route_tokens(text: str) -> int:
+    try:
+        return count_tokens(text)
+    except Exception as e:
+        # tiktoken 编码表不可用时按字符数估计(不低于 token 数)
+        logging.warning(f"Token count for routing failed, fallback to length: {str(e)}")
+        return len(text)
+
+def _match_route(route: dict, site: str, scenario: str, tokens) -> bool:
+    if route.get("site") != site:
+        return False
+    if route.get("scenario") and route["scenario"] != scenario:
+        return False
+    if tokens() is None and ("min_tokens" in route or "max_tokens" in route):
+        return False
+    if "min_tokens" in route and tokens() < route["min_tokens"]:
+        return False
+    if "max_tokens" in route and tokens() > route["max_tokens"]:
+        return False
+    return True
+
+def get_llm_config(scenario: str, site: str = None, text: str = None, tokens: int = None):
+    """
+    根据 scenario 返回 LLM 的 api_url、model、api_key、prompt_template。
+    传入调用点 site 和输入(text 或已统计的 tokens)时按路由表选择模型；只有规则需要时才统计 token。
+    """
+    settings = get_llm_settings()
+    counted = {}
+    def route_tokens():
+        if "tokens" not in counted:
+            counted["tokens"] = tokens if tokens is not None else (_count_route_tokens(text) if text is not None else None)
+        return counted["tokens"]
+    config = {
+        "api_url": settings["api_url"],
+        "model": settings["model"],
+        "api_key": settings["api_key"],
         "prompt_template": MEETING_SUMMARY_PROMPT_V4,
     }
+    if site is not None:
+        for route in settings["routes"]:
+            if _match_route(route, site, scenario, route_tokens):
+                config["model"] = route.get("model", config["model"])
+                config["api_url"] = route.get("api_url", config["api_url"])
+                if route.get("api_key_env"):
+                    config["api_key"] = os.getenv(route["api_key_env"], config["api_key"])
+                break
+    return config
@@ -1,4 +1,6 @@
+import logging
 import os
+import queue
 import pymysql
 from contextlib import contextmanager
 
@@ -7,10 +9,13 @@ MYSQL_PORT = int(os.getenv("MYSQL_PORT", 3306))
 MYSQL_USER = os.getenv("MYSQL_USER", "root")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "root")
 MYSQL_DB = os.getenv("MYSQL_DB", "marknote")
+MYSQL_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", 8))
 
-@contextmanager
-def get_connection():
-    conn = pymysql.connect(
+# 空闲连接池，后进先出以便优先复用仍然活跃的连接
+_pool = queue.LifoQueue(maxsize=MYSQL_POOL_SIZE)
+
+def _connect():
+    return pymysql.connect(
         host=MYSQL_HOST,
         port=MYSQL_PORT,
         user=MYSQL_USER,
@@ -18,10 +23,52 @@ def get_connection():
         database=MYSQL_DB,
         charset="utf8mb4"
     )
+
+def _release(conn, broken=False):
+    if broken or not conn.open:
+        if conn.open:
+            conn.close()
+        return
     try:
-        yield conn
-    finally:
+        # 结束连接上的事务: InnoDB REPEATABLE READ 下未结束的读事务会一直沿用旧快照，
+        # 复用该连接时读不到其他连接之后提交的数据
+        conn.rollback()
+    except pymysql.MySQLError:
         conn.close()
+        return
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+@contextmanager
+def get_connection():
+    try:
+        conn = _pool.get_nowait()
+        conn.ping(reconnect=True)
+    except queue.Empty:
+        conn = _connect()
+    try:
+        yield conn
+    except Exception:
+        # 出错的连接可能处于未知事务状态，不再放回连接池
+        _release(conn, broken=True)
+        raise
+    _release(conn)
+
+def warm_pool(size: int = MYSQL_POOL_SIZE):
+    """预先建立连接放入连接池"""
+    for _ in range(size - _pool.qsize()):
+        _release(_connect())
+
+def close_pool():
+    while True:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            return
+        if conn.open:
+            conn.close()
 
 def init_db():
     with get_connection() as conn:
@@ -35,6 +82,7 @@ def init_db():
                 mark_time INT,
                 time_range INT,
                 content TEXT,
+                prompt TEXT,
                 mark_type VARCHAR(16),
                 image_url TEXT,
                 user_notes TEXT,
@@ -42,11 +90,85 @@ def init_db():
                 start_time INT,
                 end_time INT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                INDEX idx_summary_id_start_time (summary_id, start_time)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            ''')
+            migrate_table(cursor, "mark_note_summary")
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS llm_usage (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                summary_id VARCHAR(128),
+                endpoint VARCHAR(64),
+                calls INT,
+                shared_calls INT DEFAULT 0,
+                prompt_tokens INT,
+                completion_tokens INT,
+                estimated_tokens INT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_summary_id (summary_id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            ''')
+            migrate_table(cursor, "llm_usage")
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS prompt_template (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                name VARCHAR(128),
+                version INT,
+                template MEDIUMTEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE KEY uk_name_version (name, version)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+            ''')
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS idempotency_result (
+                scope VARCHAR(64),
+                idempotency_key VARCHAR(255),
+                body_hash CHAR(64),
+                result MEDIUMTEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at DATETIME,
+                PRIMARY KEY (scope, idempotency_key),
+                INDEX idx_expires_at (expires_at)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
             ''')
         conn.commit()
 
+# 早于对应字段/索引创建的表需要补齐，CREATE TABLE IF NOT EXISTS 不会修改已有表
+# 表名 -> (需要的字段, 需要的索引)，各项为 (名称, ALTER 语句)
+_MIGRATIONS = {
+    "mark_note_summary": (
+        [("prompt", "ALTER TABLE mark_note_summary ADD COLUMN prompt TEXT AFTER content")],
+        [("idx_summary_id_start_time", "ALTER TABLE mark_note_summary ADD INDEX idx_summary_id_start_time (summary_id, start_time)")],
+    ),
+    "llm_usage": (
+        [("shared_calls", "ALTER TABLE llm_usage ADD COLUMN shared_calls INT DEFAULT 0 AFTER calls")],
+        [],
+    ),
+}
+
+def migrate_table(cursor, table: str):
+    """按 information_schema 检查后补齐缺少的字段和索引，重复执行不会报错"""
+    columns_sql, indexes_sql = _MIGRATIONS[table]
+    cursor.execute('''
+    SELECT COLUMN_NAME FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    ''', (table,))
+    columns = {row[0].lower() for row in cursor.fetchall()}
+    cursor.execute('''
+    SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    ''', (table,))
+    indexes = {row[0].lower() for row in cursor.fetchall()}
+    for name, sql in columns_sql:
+        if name not in columns:
+            logging.info(f"Migrating {table}: add column {name}")
+            cursor.execute(sql)
+    for name, sql in indexes_sql:
+        if name not in indexes:
+            logging.info(f"Migrating {table}: add index {name}")
+            cursor.execute(sql)
+
 def insert_mark_note_summary(data: dict):
     with get_connection() as conn:
         with conn.cursor() as cursor:
@@ -57,3 +179,144 @@ def insert_mark_note_summary(data: dict):
             '''
             cursor.execute(sql, data)
         conn.commit()
+
+def insert_llm_usage(data: dict):
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            sql = '''
+            INSERT INTO llm_usage
+            (summary_id, endpoint, calls, shared_calls, prompt_tokens, completion_tokens, estimated_tokens)
+            VALUES (%(summary_id)s, %(endpoint)s, %(calls)s, %(shared_calls)s, %(prompt_tokens)s, %(completion_tokens)s, %(estimated_tokens)s)
+            '''
+            cursor.execute(sql, data)
+        conn.commit()
+
+def get_llm_usage(summary_id: str) -> list:
+    """按接口汇总 summary_id 的 token 用量"""
+    with get_connection() as conn:
+        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            sql = '''
+            SELECT endpoint, COUNT(*) AS requests, CAST(SUM(calls) AS SIGNED) AS calls,
+                CAST(SUM(shared_calls) AS SIGNED) AS shared_calls,
+                CAST(SUM(prompt_tokens) AS SIGNED) AS prompt_tokens,
+                CAST(SUM(completion_tokens) AS SIGNED) AS completion_tokens,
+                CAST(SUM(prompt_tokens + completion_tokens) AS SIGNED) AS total_tokens
+            FROM llm_usage
+            WHERE summary_id = %s
+            GROUP BY endpoint
+            '''
+            cursor.execute(sql, (summary_id,))
+            return list(cursor.fetchall())
+
+def get_prompt_templates() -> list:
+    """读取所有已存储的 prompt 模板"""
+    with get_connection() as conn:
+        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            cursor.execute("SELECT name, version, template FROM prompt_template ORDER BY name, version")
+            return list(cursor.fetchall())
+
+def insert_prompt_template(name: str, template: str, version: int = None) -> int:
+    """保存 prompt 模板，未指定 version 时取该 name 的最大版本号 + 1，返回实际版本号"""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            if version is None:
+                cursor.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM prompt_template WHERE name = %s FOR UPDATE", (name,))
+                version = int(cursor.fetchone()[0])
+            cursor.execute(
+                "INSERT INTO prompt_template (name, version, template) VALUES (%s, %s, %s)",
+                (name, version, template)
+            )
+        conn.commit()
+    return version
+
+def get_mark_note_summaries(summary_id: str) -> list:
+    """按 summary_id 一次性读取已生成的标记摘要，按开始时间和写入顺序排序(同一窗口的重复摘要以最后写入的为准)"""
+    with get_connection() as conn:
+        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            sql = '''
+            SELECT mark_time, time_range, start_time, end_time, mark_note
+            FROM mark_note_summary
+            WHERE summary_id = %s AND mark_note IS NOT NULL
+            ORDER BY start_time, id
+            '''
+            cursor.execute(sql, (summary_id,))
+            return list(cursor.fetchall())
+
+def iter_mark_note_summaries(after_id: int = 0, summary_id: str = None, limit: int = None, batch_size: int = 500):
+    """
+    按 id 升序分批读取 mark_note_summary，逐批产出行列表。
+    每批按 id > 上一批最大 id 做键集分页，使用连接池中的连接并立即归还，
+    调用方处理一批的耗时再长也不会长时间占用连接或持有读快照。
+    """
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        with get_connection() as conn:
+            with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+                sql = '''
+                SELECT id, summary_id, language, content, mark_type, image_url, user_notes
+                FROM mark_note_summary
+                WHERE id > %s
+                '''
+                params = [after_id]
+                if summary_id:
+                    sql += " AND summary_id = %s"
+                    params.append(summary_id)
+                sql += " ORDER BY id LIMIT %s"
+                params.append(size)
+                cursor.execute(sql, params)
+                rows = list(cursor.fetchall())
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1]["id"]
+        if remaining is not None:
+            remaining -= len(rows)
+        if len(rows) < size:
+            return
+
+def get_mark_note_summaries_by_ids(ids: list) -> list:
+    """按 id 读取需要重新生成的行(字段与 iter_mark_note_summaries 一致)，按 id 升序"""
+    if not ids:
+        return []
+    with get_connection() as conn:
+        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            sql = f'''
+            SELECT id, summary_id, language, content, mark_type, image_url, user_notes
+            FROM mark_note_summary
+            WHERE id IN ({", ".join(["%s"] * len(ids))})
+            ORDER BY id
+            '''
+            cursor.execute(sql, list(ids))
+            return list(cursor.fetchall())
+
+def update_mark_note_summaries(rows: list):
+    """批量回写重新生成的摘要，rows 为 (mark_note, prompt, id) 列表"""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            sql = "UPDATE mark_note_summary SET mark_note = %s, prompt = %s WHERE id = %s"
+            cursor.executemany(sql, rows)
+        conn.commit()
+
+def get_idempotency_result(scope: str, idempotency_key: str):
+    """未过期的幂等结果 {"body_hash", "result"}(result 为 JSON 文本)，不存在时返回 None"""
+    with get_connection() as conn:
+        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            sql = '''
+            SELECT body_hash, result FROM idempotency_result
+            WHERE scope = %s AND idempotency_key = %s AND expires_at > NOW()
+            '''
+            cursor.execute(sql, (scope, idempotency_key))
+            return cursor.fetchone()
+
+def insert_idempotency_result(scope: str, idempotency_key: str, body_hash: str, result: str, ttl: int):
+    """保存幂等结果; 已有未过期的结果时保留先写入的一条，顺带清理少量过期记录"""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM idempotency_result WHERE expires_at <= NOW() LIMIT 100")
+            sql = '''
+            INSERT IGNORE INTO idempotency_result (scope, idempotency_key, body_hash, result, expires_at)
+            VALUES (%s, %s, %s, %s, NOW() + INTERVAL %s SECOND)
+            '''
+            cursor.execute(sql, (scope, idempotency_key, body_hash, result, ttl))
+        conn.commit()
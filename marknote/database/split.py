@@ -1,28 +1,35 @@
 import re
+from functools import lru_cache
 from typing import List
-import tiktoken
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# tiktoken / langchain 导入较重，按需在函数内导入，避免拖慢不需要它们的进程启动
 
 MODEL_PREFIX_TO_MODEL = {
     "gpt4-turbo": "gpt-4",
     "gpt4o": "gpt-4o",
 }
 
-def count_tokens(text: str, model_name: str = 'gpt-4o') -> int:
-    """统计文本的token数，自动适配模型。"""
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str = 'gpt-4o'):
+    """返回模型对应的 tiktoken 编码器，进程内只加载一次。"""
+    import tiktoken
     token_model_name = model_name
     for model_prefix, model in MODEL_PREFIX_TO_MODEL.items():
         if token_model_name.startswith(model_prefix):
             token_model_name = model
             break
-    token_enc = tiktoken.encoding_for_model(token_model_name)
-    tokens = token_enc.encode(text)
+    return tiktoken.encoding_for_model(token_model_name)
+
+def count_tokens(text: str, model_name: str = 'gpt-4o') -> int:
+    """统计文本的token数，自动适配模型。"""
+    tokens = get_encoding(model_name).encode(text)
     return len(tokens)
 
 def split_text_by_tokens(text: str, max_tokens: int = 5000, model_name: str = 'gpt-4o') -> List[str]:
     """
     按最大token数切分文本，返回分段列表。
     """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
     splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
         model_name=model_name,
         chunk_size=max_tokens,
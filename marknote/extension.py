@@ -1,30 +1,176 @@
+import concurrent.futures
+import json
+import logging
+from typing import List
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from marknote.api import call_llm_api
-from marknote.config import get_llm_config
-from marknote.prompt_template import EXTENSION_PROMPT
+from marknote.config import get_extension_config, get_llm_config
+from marknote.database.split import count_tokens
+from marknote.prompt_template import BATCH_EXTENSION_PROMPT, EXTENSION_PROMPT
+from marknote.prompts import compile_prompt, resolve_prompt
+from marknote.usage import bind_context, run_with_usage, save_usage, track_usage
+from marknote.profiling import ProfilingRoute
 
-router = APIRouter()
+router = APIRouter(route_class=ProfilingRoute)
+
+TIKTOKEN_MODEL = "gpt-4o"
 
 class ExtensionRequest(BaseModel):
     user_note: str = Field(..., description="用户笔记，需要扩写的内容")
     prompt: str = Field(None, description="自定义扩写提示词，可选")
+    prompt_id: str = Field(None, description="注册表中的模板ID(name 或 name:version), 可选, 优先于 prompt")
+
+class ExtensionNote(BaseModel):
+    note_id: str = Field(..., description="笔记ID, 用于对应返回结果")
+    user_note: str = Field(..., description="需要扩写的笔记内容")
+
+class ExtensionBatchRequest(BaseModel):
+    notes: List[ExtensionNote] = Field(..., description="需要扩写的笔记列表")
+    meeting_context: str = Field(None, description="会议主题或上下文, 可选")
+    summary_id: str = Field(None, description="摘要ID, 可选; 提供时记录 token 用量")
+    prompt: str = Field(None, description="自定义扩写提示词, 可选; 提供时每条笔记单独调用")
+    prompt_id: str = Field(None, description="注册表中的模板ID, 可选; 提供时每条笔记单独调用")
 
 @router.post("/mark_note/extension")
 def extension(request: ExtensionRequest):
+    return run_with_usage(None, "extension", lambda: extend_note(request))
+
+def extend_note(request: ExtensionRequest):
     try:
-        llm_cfg = get_llm_config("meeting")
-        model = llm_cfg["model"]
-        api_key = llm_cfg["api_key"]
-        api_url = llm_cfg["api_url"]
-        if request.prompt:
-            if "{{user_note}}" not in request.prompt:
-                return {"error": "自定义prompt必须包含{{user_note}}占位符"}
-            prompt = request.prompt
-        else:
-            prompt = EXTENSION_PROMPT
-        replaced_prompt = prompt.replace("{{user_note}}", request.user_note)
-        extended_text = call_llm_api(replaced_prompt, None, model, api_key, api_url)
+        try:
+            template = resolve_prompt(request.prompt_id, request.prompt, EXTENSION_PROMPT, "extension")
+        except ValueError:
+            return {"error": "自定义prompt必须包含{{user_note}}占位符"}
+        except KeyError as e:
+            return {"error": f"prompt 模板不存在: {e.args[0]}"}
+        replaced_prompt = template.render(user_note=request.user_note)
+        llm_cfg = get_llm_config("meeting", "extension", text=replaced_prompt)
+        extended_text = call_llm_api(replaced_prompt, None, llm_cfg["model"], llm_cfg["api_key"], llm_cfg["api_url"])
         return {"extended_text": extended_text}
     except Exception as e:
         return {"error": f"扩写失败: {str(e)}"}
+
+@router.post("/mark_note/extension/batch")
+def extension_batch(request: ExtensionBatchRequest):
+    """
+    批量扩写笔记，按完成顺序以 NDJSON 逐条返回 {"note_id", "extended_text"} 或 {"note_id", "error"}，
+    最后一行为 {"usage": ...}。短笔记在 token 预算内打包为一次调用，其余笔记单独并发调用。
+    """
+    cfg = get_extension_config()
+    if not request.notes:
+        return {"error": "notes 不能为空"}
+    if len(request.notes) > cfg["max_notes"]:
+        return {"error": f"notes 最多 {cfg['max_notes']} 条"}
+    try:
+        template = resolve_prompt(request.prompt_id, request.prompt, EXTENSION_PROMPT, "extension")
+    except ValueError:
+        return {"error": "自定义prompt必须包含{{user_note}}占位符"}
+    except KeyError as e:
+        return {"error": f"prompt 模板不存在: {e.args[0]}"}
+    # 自定义模板无法合并为一次调用，全部单独扩写
+    packable = not request.prompt_id and not request.prompt
+    lines = (json.dumps(item, ensure_ascii=False) + "\n" for item in stream_extensions(request, template, packable, cfg))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+def pack_notes(notes: list, max_notes: int, max_tokens: int, note_max_tokens: int):
+    """
+    把短笔记按顺序装入 pack，每个 pack 不超过 max_notes 条、笔记合计不超过 max_tokens;
+    超过 note_max_tokens 的长笔记以及只有一条笔记的 pack 单独调用。返回 (packs, singles)。
+    """
+    packs, singles = [], []
+    current, current_tokens = [], 0
+    for note in notes:
+        tokens = count_tokens(note.user_note, TIKTOKEN_MODEL)
+        if tokens > note_max_tokens:
+            singles.append(note)
+            continue
+        if current and (len(current) >= max_notes or current_tokens + tokens > max_tokens):
+            packs.append(current)
+            current, current_tokens = [], 0
+        current.append(note)
+        current_tokens += tokens
+    if current:
+        packs.append(current)
+    for pack in [pack for pack in packs if len(pack) == 1]:
+        packs.remove(pack)
+        singles.extend(pack)
+    return packs, singles
+
+def parse_batch_output(text: str) -> dict:
+    """解析打包调用的 JSON 输出，返回 id -> extended_text; 兼容代码块包裹和 {"results": [...]} 形式"""
+    start = min((idx for idx in (text.find("["), text.find("{")) if idx != -1), default=-1)
+    if start == -1:
+        return {}
+    try:
+        data, _ = json.JSONDecoder().raw_decode(text[start:])
+    except ValueError:
+        return {}
+    if isinstance(data, dict):
+        data = data.get("results", [])
+    results = {}
+    for item in data if isinstance(data, list) else []:
+        if isinstance(item, dict) and isinstance(item.get("extended_text"), str) and item["extended_text"].strip():
+            results[str(item.get("id"))] = item["extended_text"].strip()
+    return results
+
+def extend_single(note: ExtensionNote, template, meeting_context: str) -> list:
+    prompt = template.render(user_note=note.user_note, meeting_context=meeting_context)
+    llm_cfg = get_llm_config("meeting", "extension", text=prompt)
+    try:
+        extended_text = call_llm_api(prompt, None, llm_cfg["model"], llm_cfg["api_key"], llm_cfg["api_url"])
+    except Exception as e:
+        logging.error(f"Extension failed for note {note.note_id}: {str(e)}")
+        return [{"note_id": note.note_id, "error": f"扩写失败: {str(e)}"}]
+    return [{"note_id": note.note_id, "extended_text": extended_text}]
+
+def extend_pack(pack: list, meeting_context: str):
+    """一次调用扩写多条笔记，返回 (已对应的结果, 未能对应的笔记)"""
+    # pack 内使用短序号作为 id，减少 token 并避免客户端 note_id 中的特殊字符
+    notes_json = json.dumps([{"id": str(idx), "note": note.user_note} for idx, note in enumerate(pack)], ensure_ascii=False)
+    prompt = compile_prompt(BATCH_EXTENSION_PROMPT).render(notes=notes_json, meeting_context=meeting_context)
+    llm_cfg = get_llm_config("meeting", "extension", text=prompt)
+    try:
+        mapped = parse_batch_output(call_llm_api(prompt, None, llm_cfg["model"], llm_cfg["api_key"], llm_cfg["api_url"]))
+    except Exception as e:
+        logging.error(f"Packed extension of {len(pack)} notes failed: {str(e)}")
+        mapped = {}
+    results, missing = [], []
+    for idx, note in enumerate(pack):
+        if str(idx) in mapped:
+            results.append({"note_id": note.note_id, "extended_text": mapped[str(idx)]})
+        else:
+            missing.append(note)
+    if missing:
+        logging.warning(f"Packed extension returned no result for {len(missing)}/{len(pack)} notes, fallback to single calls.")
+    return results, missing
+
+def stream_extensions(request: ExtensionBatchRequest, template, packable: bool, cfg: dict):
+    """并发执行打包调用和单条调用，每有结果即产出; 打包结果缺失的笔记改为单独调用"""
+    if packable:
+        packs, singles = pack_notes(request.notes, cfg["pack_max_notes"], cfg["pack_max_tokens"], cfg["pack_note_max_tokens"])
+    else:
+        packs, singles = [], list(request.notes)
+    logging.info(f"Batch extension: {len(request.notes)} notes, {len(packs)} packs, {len(singles)} single calls.")
+    with track_usage() as tracker:
+        # 在用量上下文中绑定，线程池中的调用都计入同一个 tracker
+        run_single = bind_context(lambda note: extend_single(note, template, request.meeting_context))
+        run_pack = bind_context(lambda pack: extend_pack(pack, request.meeting_context))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=cfg["concurrency"]) as executor:
+        pending = {executor.submit(run_pack, pack): True for pack in packs}
+        pending.update({executor.submit(run_single, note): False for note in singles})
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                is_pack = pending.pop(future)
+                if is_pack:
+                    results, missing = future.result()
+                    for note in missing:
+                        pending[executor.submit(run_single, note)] = False
+                else:
+                    results = future.result()
+                yield from results
+    if request.summary_id and tracker.total_calls:
+        save_usage(request.summary_id, "extension_batch", tracker)
+    yield {"usage": tracker.to_dict()}
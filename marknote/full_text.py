@@ -3,14 +3,24 @@ from fastapi import APIRouter
 from pydantic import BaseModel, Field
 from marknote.mark_note import call_llm_api
 from marknote.config import get_llm_config
+from marknote.database.mysql_client import get_mark_note_summaries
 from typing import List
 from marknote.prompt_template import SEGMENT_SUMMARY_PROMPT, MERGE_MARKNOTE_PROMPT, FINAL_MARKNOTE_PROMPT_V2
+from marknote.database.split import count_tokens
+from marknote.prompts import compile_prompt, resolve_prompt
+from marknote.transcript import iter_bracket_text, iter_transcript, format_bracket_line
+from marknote.usage import bind_context, get_current_usage, run_with_usage
+from marknote.profiling import ProfilingRoute
 import concurrent.futures
-import tiktoken
 
-router = APIRouter()
+router = APIRouter(route_class=ProfilingRoute)
 
 TIKTOKEN_MODEL = "gpt-4o"
+# 逐级加大的分段 token 上限，预算不足时使用更粗的分段以减少 map 调用
+SEGMENT_MAX_TOKENS_LEVELS = [5000, 10000, 20000]
+# 预估时每次调用的输出 token 数
+SEGMENT_COMPLETION_TOKENS = 150
+FINAL_COMPLETION_TOKENS = 1500
 
 class MarkNoteItem(BaseModel):
     start_time: int = Field(..., description="开始时间")
@@ -20,39 +30,43 @@ class MarkNoteItem(BaseModel):
 
 class FullTextRequest(BaseModel):
     prompt: str = Field(None, description="自定义提示内容, 可选")
-    full_text: str = Field(..., description="完整文本")
+    prompt_id: str = Field(None, description="注册表中的模板ID(name 或 name:version), 可选, 优先于 prompt")
+    full_text: str = Field(None, description="完整文本, 与 transcript_id 二选一")
+    transcript_id: str = Field(None, description="POST /transcript 返回的转写ID, 与 full_text 二选一")
     mark_notes: List[MarkNoteItem] = Field(..., description="标注笔记列表")
+    summary_id: str = Field(None, description="摘要ID, 可选; 提供时复用 /mark_note/summary 已存储的标记摘要")
+    max_tokens_budget: int = Field(None, description="本次请求的 token 预算, 可选; 预估超出时先加大分段、再只处理带标记的片段")
 
 @router.post("/mark_note/full_text")
 def mark_note_full_text(request: FullTextRequest):
+    return run_with_usage(request.summary_id, "full_text", lambda: summarize_full_text(request))
+
+def summarize_full_text(request: FullTextRequest):
     try:
-        # 1. 切分 full_text 为片段
-        lines = [line for line in request.full_text.strip().split('\n') if line]
-        llm_cfg = get_llm_config("meeting")
-        model = llm_cfg["model"]
-        api_key = llm_cfg["api_key"]
-        api_url = llm_cfg["api_url"]
-        summary_objects = []
-        # 2. 对每个片段用 LLM 进行 summary
-        for line in lines:
-            # 解析时间戳
-            time_start = line.find('[')
-            time_end = line.find(']', time_start)
-            speaker_start = line.find('[', time_end + 1)
-            speaker_end = line.find(']', speaker_start)
-            if -1 in (time_start, time_end, speaker_start, speaker_end):
-                continue
-            time_text = line[time_start+1:time_end]
-            try:
-                start, end = map(int, time_text.split('-'))
-            except ValueError:
-                continue
-            summary_objects.append({
-                "start_time": start,
-                "end_time": end,
-                "summary": line
-            })
+        # 1. 逐行解析 full_text 或已上传的转写
+        if request.transcript_id:
+            transcript_lines = iter_transcript(request.transcript_id)
+        elif request.full_text:
+            transcript_lines = iter_bracket_text(request.full_text)
+        else:
+            return {"error": "full_text or transcript_id is required"}
+        # 2. 每行作为一个带时间戳的片段
+        summary_objects = [
+            {
+                "start_time": line.start,
+                "end_time": line.end,
+                "summary": format_bracket_line(line)
+            }
+            for line in transcript_lines
+        ]
+        line_count = len(summary_objects)
         summary_objects.sort(key=lambda x: x["start_time"])
+        # 3. 复用已存储的标记摘要，完全被其时间窗口覆盖的片段不再进入 map 阶段
+        stored_summaries = load_stored_summaries(request.summary_id)
+        if stored_summaries:
+            total = len(summary_objects)
+            summary_objects = [so for so in summary_objects if not is_covered(so, stored_summaries)]
+            logging.info(f"Reused {len(stored_summaries)} stored summaries, {total - len(summary_objects)}/{total} lines covered.")
         sorted_mark_notes = sorted(request.mark_notes, key=lambda x: x.start_time)
         # 合并所有与 mark_note 区间有重叠的 summary_object
         merged_list = []
@@ -88,48 +102,78 @@ def mark_note_full_text(request: FullTextRequest):
                 })
         # 保持顺序（按 start_time 排序）
         merged_list.sort(key=lambda x: x["start_time"] if x.get("start_time") is not None else 0)
-        logging.info(f"Received {len(lines)} lines of full text for processing.")
-        merged_list = merge_segments_by_token_count(merged_list)
-        logging.info(f"Processed {len(merged_list)} merged segments from full text.")
+        logging.info(f"Received {line_count} lines of full text for processing.")
+        try:
+            prompt = resolve_prompt(request.prompt_id, request.prompt, FINAL_MARKNOTE_PROMPT_V2, "full_text")
+        except (KeyError, ValueError) as e:
+            return {"error": f"Invalid prompt: {e.args[0]}"}
+        # 构造标记说明
+        mark_tags = []
+        for note in request.mark_notes:
+            tag = f'[#{{ "type": "mark", "value": {{"start_time":{note.start_time}, "end_time":{note.end_time}, "note_id": "{note.note_id}"}}}}#]'
+            mark_tags.append({"content": note.content, "tag": tag})
+        mark_tags_str = "\n".join([f'- {item["content"]} {item["tag"]}' for item in mark_tags])
+        logging.info(f"mark_tags_str: {mark_tags_str}")
+        # 预估 token 用量，超出预算时降级分段方式
+        def estimate(segments):
+            return estimate_full_text_tokens(segments, stored_summaries, prompt.text, mark_tags_str)
+        # 没有笔记片段也没有已存储摘要时，notes_only 只会对空内容做 reduce，按超预算拒绝
+        merged_list, segment_max_tokens, degraded, estimated_tokens = plan_segments(
+            merged_list, request.max_tokens_budget, estimate, allow_empty=bool(stored_summaries)
+        )
+        usage = get_current_usage()
+        if usage is not None:
+            usage.estimated_tokens = estimated_tokens
+        budget = {
+            "max_tokens_budget": request.max_tokens_budget,
+            "estimated_tokens": estimated_tokens,
+            "segment_max_tokens": segment_max_tokens,
+            "degraded": degraded
+        }
+        if request.max_tokens_budget is not None and estimated_tokens > request.max_tokens_budget:
+            logging.error(f"Full text estimated {estimated_tokens} tokens exceeds budget {request.max_tokens_budget}")
+            return {
+                "error": f"Estimated {estimated_tokens} tokens exceeds max_tokens_budget {request.max_tokens_budget}",
+                "budget": budget
+            }
+        logging.info(f"Processed {len(merged_list)} merged segments from full text, estimated {estimated_tokens} tokens.")
         # 4. 多线程并发对合并后的内容执行 summary
         marknote_results = []
         def summarize_merged(item):
             if item["note"] is not None:
                 # LLM summary for merged + marknote content
-                replaced_prompt = MERGE_MARKNOTE_PROMPT.replace("{{meeting_summaries}}", item["merged_text"]).replace("{{key_note}}", item["note"])
-                merged_summary = call_llm_api(replaced_prompt, None, model, api_key, api_url)
+                replaced_prompt = compile_prompt(MERGE_MARKNOTE_PROMPT).render(meeting_summaries=item["merged_text"], key_note=item["note"])
+                llm_cfg = get_llm_config("meeting", "merge", tokens=item["tokens"])
+                merged_summary = call_llm_api(replaced_prompt, None, llm_cfg["model"], llm_cfg["api_key"], llm_cfg["api_url"])
                 return {
                     "summary": merged_summary
                 }
             else:
-                replaced_prompt = SEGMENT_SUMMARY_PROMPT.replace("{{meeting_summaries}}", item["merged_text"])
-                merged_summary = call_llm_api(replaced_prompt, None, model, api_key, api_url)
+                replaced_prompt = compile_prompt(SEGMENT_SUMMARY_PROMPT).render(meeting_summaries=item["merged_text"])
+                llm_cfg = get_llm_config("meeting", "segment", tokens=item["tokens"])
+                merged_summary = call_llm_api(replaced_prompt, None, llm_cfg["model"], llm_cfg["api_key"], llm_cfg["api_url"])
                 return {
                     "start_time": None,
                     "end_time": None,
                     "summary": merged_summary
                 }
         with concurrent.futures.ThreadPoolExecutor() as executor:
-            marknote_results = list(executor.map(summarize_merged, merged_list))
-        prompt = None
-        if request.prompt is None:
-            prompt = FINAL_MARKNOTE_PROMPT_V2
-        else:
-            prompt = request.prompt
+            marknote_results = list(executor.map(bind_context(summarize_merged), merged_list))
+        # 已存储的标记摘要与新生成的片段摘要按时间顺序一起进入 reduce 阶段
+        if stored_summaries:
+            ordered = [(item.get("start_time") or 0, result) for item, result in zip(merged_list, marknote_results)]
+            ordered += [(so["start_time"], so) for so in stored_summaries]
+            ordered.sort(key=lambda x: x[0])
+            marknote_results = [result for _, result in ordered]
         # 5. 汇总所有 marknote_results，要求 LLM 输出中必须包含每个 mark_note 的内容，并在对应内容后加标记
         all_summaries = "\n".join([item["summary"] for item in marknote_results])
-        # 构造标记说明
-        mark_tags = []
-        for note in request.mark_notes:
-            tag = f'[#{{ "type": "mark", "value": {{"start_time":{note.start_time}, "end_time":{note.end_time}, "note_id": "{note.note_id}"}}}}#]'
-            mark_tags.append({"content": note.content, "tag": tag})
-        mark_tags_str = "\n".join([f'- {item["content"]} {item["tag"]}' for item in mark_tags])
-        logging.info(f"mark_tags_str: {mark_tags_str}")
-        final_prompt = prompt.replace("{{section_summaries}}", all_summaries).replace("{{mark_notes}}", mark_tags_str)
-        final_summary = call_llm_api(final_prompt, None, model, api_key, api_url)
+        final_prompt = prompt.render(section_summaries=all_summaries, mark_notes=mark_tags_str)
+        llm_cfg = get_llm_config("meeting", "final", text=final_prompt)
+        final_summary = call_llm_api(final_prompt, None, llm_cfg["model"], llm_cfg["api_key"], llm_cfg["api_url"])
         return {
             "marknote_results": marknote_results,
-            "final_summary": final_summary
+            "final_summary": final_summary,
+            "budget": budget
         }
     except Exception as e:
         logging.error(f"Full text summary failed: {str(e)}")
@@ -142,25 +186,32 @@ def merge_segments_by_token_count(merged_list, max_tokens=5000):
     merged_list 中的 item["note"] 已经是 string 或 None。
     使用 tiktoken 统计 token 数。
     """
-    encoding = tiktoken.encoding_for_model(TIKTOKEN_MODEL)
-    def count_tokens(text):
-        return len(encoding.encode(text))
-
     result = []
     buffer = []
     notes = []
     token_sum = 0
+    start_time, end_time = None, None
     for item in merged_list:
-        tokens = count_tokens(item["merged_text"])
+        tokens = item.get("tokens")
+        if tokens is None:
+            # 缓存到 item 上，按不同 max_tokens 重新分段时不必重复计数
+            tokens = item["tokens"] = count_tokens(item["merged_text"], TIKTOKEN_MODEL)
         if token_sum + tokens > max_tokens and buffer:
             note_str = "\n".join([n for n in notes if n]) if notes else None
             result.append({
                 "note": note_str,
-                "merged_text": "\n".join(buffer)
+                "merged_text": "\n".join(buffer),
+                "start_time": start_time,
+                "end_time": end_time,
+                "tokens": token_sum
             })
             buffer = []
             notes = []
             token_sum = 0
+            start_time, end_time = None, None
+        if start_time is None:
+            start_time = item.get("start_time")
+        end_time = item.get("end_time", end_time)
         buffer.append(item["merged_text"])
         if item["note"]:
             if isinstance(item["note"], list):
@@ -172,6 +223,77 @@ def merge_segments_by_token_count(merged_list, max_tokens=5000):
         note_str = "\n".join([n for n in notes if n]) if notes else None
         result.append({
             "note": note_str,
-            "merged_text": "\n".join(buffer)
+            "merged_text": "\n".join(buffer),
+            "start_time": start_time,
+            "end_time": end_time,
+            "tokens": token_sum
         })
     return result
+
+def estimate_full_text_tokens(segments, stored_summaries, final_prompt, mark_tags_str):
+    """用 tiktoken 预估 map + reduce 全流程的 token 数(输入按实际内容计数，输出按固定值估计)"""
+    merge_overhead = count_tokens(MERGE_MARKNOTE_PROMPT, TIKTOKEN_MODEL)
+    segment_overhead = count_tokens(SEGMENT_SUMMARY_PROMPT, TIKTOKEN_MODEL)
+    total = 0
+    for seg in segments:
+        if seg["note"] is not None:
+            total += merge_overhead + count_tokens(seg["note"], TIKTOKEN_MODEL)
+        else:
+            total += segment_overhead
+        total += seg["tokens"] + SEGMENT_COMPLETION_TOKENS
+    total += count_tokens(final_prompt, TIKTOKEN_MODEL) + count_tokens(mark_tags_str, TIKTOKEN_MODEL)
+    total += len(segments) * SEGMENT_COMPLETION_TOKENS
+    total += sum(count_tokens(so["summary"], TIKTOKEN_MODEL) for so in stored_summaries)
+    return total + FINAL_COMPLETION_TOKENS
+
+def plan_segments(merged_list, budget, estimate, allow_empty=True):
+    """
+    按预算选择分段方式，返回 (segments, segment_max_tokens, degraded, estimated_tokens)。
+    依次尝试更粗的分段；仍超预算时只对带标记笔记的片段做 map，未标记内容不进入汇总。
+    没有带笔记的片段且 allow_empty 为 False 时返回最粗分段的估计，由调用方按超预算拒绝。
+    未设置预算时直接使用默认分段。
+    """
+    for max_tokens in SEGMENT_MAX_TOKENS_LEVELS:
+        segments = merge_segments_by_token_count(merged_list, max_tokens)
+        estimated = estimate(segments)
+        if budget is None or estimated <= budget:
+            degraded = None if max_tokens == SEGMENT_MAX_TOKENS_LEVELS[0] else "coarse_segments"
+            return segments, max_tokens, degraded, estimated
+    noted = [seg for seg in segments if seg["note"]]
+    if not noted and not allow_empty:
+        return segments, max_tokens, "notes_only", estimated
+    return noted, max_tokens, "notes_only", estimate(noted)
+
+def load_stored_summaries(summary_id):
+    """
+    读取 summary_id 下已存储的标记摘要，返回按 start_time 排序的列表。
+    同一时间窗口重复生成的摘要只保留最后一条；查询失败时返回空列表，退回完整 map 阶段。
+    """
+    if not summary_id:
+        return []
+    try:
+        rows = get_mark_note_summaries(summary_id)
+    except Exception as e:
+        logging.error(f"Failed to load stored summaries for {summary_id}: {str(e)}")
+        return []
+    stored = {}
+    for row in rows:
+        start = row["start_time"] if row["start_time"] is not None else row["mark_time"] - row["time_range"]
+        end = row["end_time"] if row["end_time"] is not None else row["mark_time"] + row["time_range"]
+        stored[(start, end)] = {
+            "start_time": start,
+            "end_time": end,
+            "summary": row["mark_note"]
+        }
+    return sorted(stored.values(), key=lambda x: x["start_time"])
+
+def is_covered(summary_object, stored_summaries):
+    """片段完全落在已存储窗口(相邻窗口连续覆盖也可)内才视为已覆盖，只部分重叠的片段仍进入 map 阶段"""
+    covered_until = summary_object["start_time"]
+    for so in stored_summaries:
+        if so["start_time"] > covered_until:
+            break
+        covered_until = max(covered_until, so["end_time"])
+        if covered_until >= summary_object["end_time"]:
+            return True
+    return False
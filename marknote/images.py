@@ -1,63 +1,236 @@
 import os
 import shutil
 import base64
-import boto3
-from fastapi import UploadFile, File, APIRouter, Body
+import hashlib
+import logging
+import mimetypes
+import mmap
+import tempfile
+import threading
+import time
+import concurrent.futures
+from typing import List
+from fastapi import UploadFile, File, APIRouter, Body, Header
 from fastapi.responses import JSONResponse
 from marknote.api import call_llm_api
-from marknote.config import get_aws_s3_config, get_llm_config
+from marknote.cache import TTLCache
+from marknote.config import get_aws_s3_config, get_image_config, get_llm_config
 from marknote.prompt_template import IMAGE_PROMPT
+from marknote.prompts import compile_prompt, resolve_prompt
+from marknote.singleflight import run_idempotent
+from marknote.usage import bind_context, run_with_usage
+from marknote.profiling import ProfilingRoute
 from pydantic import BaseModel, Field
 
-router = APIRouter()
+router = APIRouter(route_class=ProfilingRoute)
 
 class ImageSummaryRequest(BaseModel):
-    image_url: str = Field(..., description="图片的URL地址")
+    image_url: str = Field(None, description="图片的URL地址, 与 image_urls 二选一")
+    image_urls: List[str] = Field(None, description="批量图片URL列表, 并发提取, 与 image_url 二选一")
     user_context: str = Field(None, description="可选，用户补充的图片分析目标或场景")
     language: str = Field(..., description="输出语言，如zh, en等")
     prompt: str = Field(None, description="可选，自选prompt")
+    prompt_id: str = Field(None, description="可选，注册表中的模板ID(name 或 name:version), 优先于 prompt")
+
+_image_cfg = get_image_config()
+# 图片内容提取结果缓存，key 为图片 URL 的哈希 + 输出语言/上下文/prompt
+_image_content_cache = TTLCache(_image_cfg["cache_size"], _image_cfg["cache_ttl"])
 
 @router.post("/image/summary")
-def image_summary(request: ImageSummaryRequest):
+def image_summary(request: ImageSummaryRequest, idempotency_key: str = Header(None, alias="Idempotency-Key")):
     """
-    接收图片URL、输出语言和可选上下文，通过大模型提取图片关键信息。
+    接收图片URL(或URL列表)、输出语言和可选上下文，通过大模型提取图片关键信息。
     """
+    return run_idempotent(
+        "image_summary",
+        idempotency_key,
+        request,
+        lambda: run_with_usage(None, "image_summary", lambda: summarize_image(request))
+    )
+
+def summarize_image(request: ImageSummaryRequest):
     try:
-        llm_cfg = get_llm_config("meeting")
-        model = llm_cfg["model"]
-        api_key = llm_cfg["api_key"]
-        api_url = llm_cfg["api_url"]
-        # 构造标准 prompt
-        if request.prompt:
-            prompt = request.prompt
-        else:
-            prompt = IMAGE_PROMPT
-        if request.user_context is not None:
-            prompt = prompt.replace("{{user_context}}", request.user_context or "")
-        prompt = prompt.replace("{{language}}", request.language)
-        summary = call_llm_api(prompt, [request.image_url], model, api_key, api_url)
+        try:
+            prompt = resolve_prompt(request.prompt_id, request.prompt, IMAGE_PROMPT, "image").text
+        except KeyError as e:
+            return {"error": f"prompt 模板不存在: {e.args[0]}"}
+        if request.image_urls:
+            results = extract_image_contents(request.image_urls, request.language, request.user_context, prompt)
+            return {"summaries": results}
+        if not request.image_url:
+            return {"error": "必须提供 image_url 或 image_urls"}
+        summary = extract_image_content(request.image_url, request.language, request.user_context, prompt)
         return {"summary": summary}
     except Exception as e:
         return {"error": f"图片内容提取失败: {str(e)}"}
 
-def fetch_image_from_s3(s3_key: str) -> str:
+def image_cache_key(image_url: str, language: str, user_context: str = None, prompt: str = None) -> str:
+    """缓存 key: data URL 即图片内容本身，s3:// 以 bucket/key/ETag 标识，其他 URL 以地址标识图片"""
+    if image_url.startswith("s3://"):
+        bucket, key = parse_s3_url(image_url)
+        image_url = f"{image_url}#{s3_object_etag(key, bucket)}"
+    raw = "\x00".join([image_url, language, user_context or "", prompt or ""])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def extract_image_content(image_url: str, language: str, user_context: str = None, prompt: str = None) -> str:
+    """单张图片调用视觉模型提取内容，结果按图片 URL（data: URL 为内容，s3:// 为 bucket/key/ETag）缓存"""
+    key = image_cache_key(image_url, language, user_context, prompt)
+    cached = _image_content_cache.get(key)
+    if cached is not None:
+        return cached
+    llm_cfg = get_llm_config("meeting", "image")
+    model = llm_cfg["model"]
+    api_key = llm_cfg["api_key"]
+    api_url = llm_cfg["api_url"]
+    # 构造标准 prompt
+    prompt = compile_prompt(prompt or IMAGE_PROMPT).render(user_context=user_context, language=language)
+    summary = call_llm_api(prompt, [resolve_image_url(image_url)], model, api_key, api_url)
+    _image_content_cache.set(key, summary)
+    return summary
+
+def extract_image_contents(image_urls: List[str], language: str, user_context: str = None, prompt: str = None) -> list:
+    """
+    并发提取多张图片内容，返回与输入顺序一致的 {"image_url", "summary"} 列表;
+    单张失败时该项为 {"image_url", "error"}，不影响其他图片。
+    """
+    def extract(url):
+        try:
+            return {"image_url": url, "summary": extract_image_content(url, language, user_context, prompt)}
+        except Exception as e:
+            logging.error(f"Image content extraction failed for {url}: {str(e)}")
+            return {"image_url": url, "error": f"图片内容提取失败: {str(e)}"}
+    if not image_urls:
+        return []
+    max_workers = min(len(image_urls), _image_cfg["concurrency"])
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(bind_context(extract), image_urls))
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+_s3_cache_lock = threading.Lock()
+# 最近 N 秒内下载或命中的文件可能正被其他请求读取，淘汰时跳过
+S3_CACHE_MIN_AGE = 60
+_s3_etag_cache = TTLCache(_image_cfg["cache_size"], get_aws_s3_config()["etag_ttl"])
+
+def get_s3_client():
+    """进程内共享的 S3 客户端(boto3 client 线程安全)，连接池大小由 S3_POOL_SIZE 控制"""
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                import boto3
+                from botocore.config import Config
+                aws_cfg = get_aws_s3_config()
+                _s3_client = boto3.client(
+                    "s3",
+                    aws_access_key_id=aws_cfg["aws_access_key_id"],
+                    aws_secret_access_key=aws_cfg["aws_secret_access_key"],
+                    region_name=aws_cfg["region_name"],
+                    config=Config(max_pool_connections=aws_cfg["pool_size"], retries={"max_attempts": 3, "mode": "adaptive"})
+                )
+    return _s3_client
+
+def parse_s3_url(url: str):
+    """s3://bucket/key -> (bucket, key)"""
+    bucket, _, key = url[len("s3://"):].partition("/")
+    return bucket, key
+
+def presign_s3_url(s3_key: str, bucket: str = None) -> str:
+    """生成预签名 GET 地址，让 LLM 直接从 S3 拉取图片"""
     aws_cfg = get_aws_s3_config()
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=aws_cfg["aws_access_key_id"],
-        aws_secret_access_key=aws_cfg["aws_secret_access_key"],
-        region_name=aws_cfg["region_name"]
+    return get_s3_client().generate_presigned_url(
+        "get_object",
+        Params={"Bucket": bucket or aws_cfg["bucket"], "Key": s3_key},
+        ExpiresIn=aws_cfg["presign_expires"]
     )
-    local_path = f"/tmp/{os.path.basename(s3_key)}"
-    s3_client.download_file(aws_cfg["bucket"], s3_key, local_path)
+
+def s3_object_etag(s3_key: str, bucket: str = None) -> str:
+    """对象的 ETag，按 bucket/key 缓存 S3_ETAG_TTL 秒，重复引用同一图片时不必每次 head_object"""
+    bucket = bucket or get_aws_s3_config()["bucket"]
+    cache_key = f"{bucket}/{s3_key}"
+    etag = _s3_etag_cache.get(cache_key)
+    if etag is None:
+        head = get_s3_client().head_object(Bucket=bucket, Key=s3_key)
+        etag = head["ETag"].strip('"')
+        _s3_etag_cache.set(cache_key, etag)
+    return etag
+
+def fetch_image_from_s3(s3_key: str, bucket: str = None) -> str:
+    """
+    下载 S3 图片到本地缓存目录并返回路径。缓存文件名由 bucket/key/ETag 哈希得到，
+    不同用户的同名文件不会冲突，对象更新后 ETag 变化自动失效。
+    """
+    aws_cfg = get_aws_s3_config()
+    bucket = bucket or aws_cfg["bucket"]
+    etag = s3_object_etag(s3_key, bucket)
+    digest = hashlib.sha256(f"{bucket}/{s3_key}/{etag}".encode("utf-8")).hexdigest()
+    cache_dir = aws_cfg["cache_dir"]
+    os.makedirs(cache_dir, exist_ok=True)
+    local_path = os.path.join(cache_dir, digest + os.path.splitext(s3_key)[-1])
+    try:
+        # 更新 mtime，作为 LRU 淘汰依据
+        os.utime(local_path)
+        return local_path
+    except FileNotFoundError:
+        pass
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".part")
+    os.close(fd)
+    try:
+        get_s3_client().download_file(bucket, s3_key, tmp_path)
+        os.replace(tmp_path, local_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    evict_local_cache(cache_dir, aws_cfg["cache_max_bytes"])
     return local_path
 
+def evict_local_cache(cache_dir: str, max_bytes: int, min_age: float = None):
+    """本地缓存总大小超过 max_bytes 时按 mtime 从旧到新删除，最近 min_age 秒内使用过的文件不删除"""
+    min_age = S3_CACHE_MIN_AGE if min_age is None else min_age
+    now = time.time()
+    with _s3_cache_lock:
+        entries = []
+        for entry in os.scandir(cache_dir):
+            if entry.is_file() and not entry.name.endswith(".part"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= max_bytes or now - mtime < min_age:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+def resolve_image_url(image_url: str) -> str:
+    """
+    s3://bucket/key 转换为 LLM 可访问的地址: 默认预签名，由 LLM 直接拉取;
+    S3_IMAGE_DELIVERY=inline 时经本地缓存下载并内联为 base64 data URL。
+    """
+    if not image_url.startswith("s3://"):
+        return image_url
+    bucket, key = parse_s3_url(image_url)
+    if get_aws_s3_config()["delivery"] == "inline":
+        mime_type = mimetypes.guess_type(key)[0] or "image/jpeg"
+        try:
+            data = encode_image(fetch_image_from_s3(key, bucket))
+        except FileNotFoundError:
+            # 缓存文件在返回后被其他进程淘汰，重新下载一次
+            data = encode_image(fetch_image_from_s3(key, bucket))
+        return f"data:{mime_type};base64,{data}"
+    return presign_s3_url(key, bucket)
+
 def encode_image(image_path: str) -> str:
-    """将图片文件编码为Base64字符串"""
+    """将图片文件编码为Base64字符串; 通过 mmap 读取，避免额外复制一份文件内容"""
     if not os.path.exists(image_path):
         raise FileNotFoundError(f"图片文件不存在: {image_path}")
     with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+        if os.fstat(image_file.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return base64.b64encode(mapped).decode('utf-8')
 
 def upload_image(file: UploadFile = File(...)):
     """上传图片，保存到 images 目录，返回相对路径"""
@@ -80,8 +253,5 @@ def upload_image(file: UploadFile = File(...)):
 def image_path_to_base64(rel_path: str) -> str:
     """根据图片相对路径，将图片转为base64字符串"""
     abs_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), rel_path)
-    if not os.path.exists(abs_path):
-        raise FileNotFoundError(f"图片文件不存在: {abs_path}")
-    with open(abs_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+    return encode_image(abs_path)
 
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+from logging.handlers import TimedRotatingFileHandler
+import anyio.to_thread
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import JSONResponse
+from marknote.api import get_http_session, close_http_session
+from marknote.config import get_server_config, get_llm_settings
+from marknote.database.mysql_client import warm_pool, close_pool
+from marknote.database.split import get_encoding
+from marknote.live import check_live_mode, shutdown_live
+from marknote.prompts import reload_prompts
+
+router = APIRouter()
+
+# 预热状态: 每个步骤的结果及是否全部完成
+_warmup_state = {"ready": False, "steps": {}}
+
+def configure_logging():
+    """日志配置; 多 worker 时按进程拆分日志文件，避免多个进程同时切分同一个文件"""
+    server_cfg = get_server_config()
+    log_dir = server_cfg["log_dir"]
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    if not log_dir:
+        return
+    os.makedirs(log_dir, exist_ok=True)
+    log_time = datetime.now().strftime("%Y%m%d%H")
+    if server_cfg["workers"] > 1:
+        log_file = os.path.join(log_dir, f"marknote-{log_time}-{os.getpid()}.log")
+    else:
+        log_file = os.path.join(log_dir, f"marknote-{log_time}.log")
+
+    handler = TimedRotatingFileHandler(log_file, when="H", interval=1, backupCount=168, encoding="utf-8")
+    formatter = logging.Formatter("[%(asctime)s][%(levelname)s][%(filename)s:%(lineno)d]: %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    handler.setFormatter(formatter)
+    logger.handlers.clear()
+    logger.addHandler(handler)
+
+def preload():
+    """
+    fork 前在 master 进程中加载重量级依赖和 tiktoken 编码表，worker 通过写时复制共享这些内存页。
+    只加载模块和只读数据，连接类资源仍由各 worker 在 warm_up 中创建。
+    """
+    import boto3
+    import langchain_text_splitters
+    try:
+        get_encoding("gpt-4o")
+    except Exception as e:
+        logging.error(f"Preload tiktoken encoding failed: {str(e)}")
+
+def warm_up():
+    """预热共享资源: HTTP 连接池、MySQL 连接池、tiktoken 编码器、LLM 配置和 prompt 注册表。单步失败只记录，不阻塞启动"""
+    steps = {
+        "http": get_http_session,
+        "mysql": warm_pool,
+        "tiktoken": lambda: get_encoding("gpt-4o"),
+        "llm_config": get_llm_settings,
+        "prompts": reload_prompts,
+    }
+    for name, step in steps.items():
+        try:
+            step()
+            _warmup_state["steps"][name] = "ok"
+        except Exception as e:
+            logging.error(f"Warm-up step {name} failed: {str(e)}")
+            _warmup_state["steps"][name] = f"error: {str(e)}"
+    _warmup_state["ready"] = True
+    logging.info(f"Warm-up finished: {_warmup_state['steps']}")
+
+def drain():
+    """关闭共享资源，在 worker 退出前释放连接"""
+    _warmup_state["ready"] = False
+    shutdown_live()
+    close_http_session()
+    close_pool()
+    logging.info("Shared resources drained.")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_logging()
+    check_live_mode()
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = get_server_config()["threadpool_size"]
+    # 预热放到后台线程，存活探针 / 在预热期间仍可响应
+    warmup_task = asyncio.create_task(asyncio.to_thread(warm_up))
+    try:
+        yield
+    finally:
+        if not warmup_task.done():
+            await warmup_task
+        await asyncio.to_thread(drain)
+
+@router.get("/ready")
+def ready():
+    """就绪探针: 预热完成前返回 503"""
+    status_code = 200 if _warmup_state["ready"] else 503
+    return JSONResponse(status_code=status_code, content=_warmup_state)
@@ -0,0 +1,237 @@
+"""
+录音过程中的滚动窗口预摘要。
+
+开启 LIVE_PRESUMMARIZE 后，客户端把实时转写行推送到 POST /live/{summary_id}/lines，
+每凑满一个窗口(LIVE_WINDOW_SECONDS，按 LIVE_WINDOW_STRIDE 滑动)就在后台线程池中生成该窗口的摘要。
+time 类型的标记优先使用覆盖其窗口的预摘要; 标记窗口的结尾超出预摘要窗口时，
+只把预摘要和其后的转写行交给 LLM 增量更新，用户等待的调用输入很短。
+
+会话和窗口摘要保存在进程内存中，同一会议的推送和标记必须落到同一进程，
+因此 WEB_CONCURRENCY > 1 时不开启实时预摘要(推送接口返回错误，标记走常规流程)。
+"""
+import concurrent.futures
+import logging
+import threading
+from collections import OrderedDict
+from fastapi import APIRouter
+from pydantic import BaseModel, Field
+from marknote.api import call_llm_api
+from marknote.cache import TTLCache
+from marknote.config import get_live_config, get_llm_config, get_server_config
+from marknote.prompt_template import LIVE_INCREMENTAL_PROMPT
+from marknote.prompts import REQUIRED_PLACEHOLDERS, compile_prompt
+from marknote.transcript import format_speaker_line, iter_bracket_text
+from marknote.usage import save_usage, track_usage
+from marknote.profiling import ProfilingRoute
+
+router = APIRouter(route_class=ProfilingRoute)
+
+class LiveLinesRequest(BaseModel):
+    language: str = Field(..., description="摘要语言，如chinese, english等")
+    content: str = Field(..., description="新增的转写行, [start-end][speaker] content 格式, 可多行")
+
+class LiveSession:
+    """一个 summary_id 的实时转写缓冲和已完成的窗口摘要"""
+    def __init__(self, summary_id: str, language: str, cfg: dict):
+        self.summary_id = summary_id
+        self.language = language
+        self.cfg = cfg
+        self.lock = threading.Lock()
+        self.lines = []
+        self.max_end = None
+        self.next_window_start = None
+        # window_start -> {"start", "end", "content", "prompt", "summary"}
+        self.windows = OrderedDict()
+        self.pending = 0
+
+    def feed(self, lines: list) -> list:
+        """追加转写行，返回新凑满、需要生成摘要的窗口 (start, end, content) 列表"""
+        window, stride = self.cfg["window"], self.cfg["stride"]
+        ready = []
+        with self.lock:
+            for line in lines:
+                self.lines.append(line)
+                if self.max_end is None or line.end > self.max_end:
+                    self.max_end = line.end
+                if self.next_window_start is None:
+                    self.next_window_start = line.start // stride * stride
+            if self.max_end is None:
+                return ready
+            while self.next_window_start + window <= self.max_end:
+                start = self.next_window_start
+                ready.append((start, start + window, self.window_content(start, start + window)))
+                self.next_window_start += stride
+            # 只保留最近 retain 秒的转写行，较早的内容已经进入窗口摘要
+            keep_from = self.max_end - max(self.cfg["retain"], window * 2)
+            self.lines = [line for line in self.lines if line.end >= keep_from]
+            self.pending += len(ready)
+        return ready
+
+    def window_content(self, start: int, end: int) -> str:
+        """与 transcript_window 相同的窗口规则"""
+        return "\n".join(format_speaker_line(line) for line in self.lines if line.end >= start and line.start <= end)
+
+    def tail_content(self, after: int, end: int):
+        """after 之后开始、end 之前的转写行; 这段内容已不在缓冲中时返回 None"""
+        with self.lock:
+            if not self.lines or self.lines[0].start > after:
+                return None
+            return "\n".join(format_speaker_line(line) for line in self.lines if after < line.start <= end)
+
+    def store(self, start: int, window: dict):
+        with self.lock:
+            self.windows[start] = window
+            while len(self.windows) > self.cfg["max_windows"]:
+                self.windows.popitem(last=False)
+
+    def covering_window(self, start: int, end: int):
+        """
+        从 start 开始覆盖 [start, end] 最长的已完成窗口(窗口开始不晚于 start)，覆盖相同时取较晚开始的窗口。
+        开始于 start 之后的窗口缺少标记开头的内容，不会被选中。
+        """
+        best, best_key = None, None
+        with self.lock:
+            for window in self.windows.values():
+                if not window["start"] <= start < window["end"]:
+                    continue
+                key = (min(end, window["end"]) - start, window["start"])
+                if best_key is None or key > best_key:
+                    best, best_key = window, key
+        return best
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                "summary_id": self.summary_id,
+                "language": self.language,
+                "max_end": self.max_end,
+                "buffered_lines": len(self.lines),
+                "pending_windows": self.pending,
+                "windows": [{"start": w["start"], "end": w["end"]} for w in self.windows.values()],
+            }
+
+_live_cfg = get_live_config()
+_live_cfg["workers"] = get_server_config()["workers"]
+_sessions = TTLCache(_live_cfg["max_sessions"], _live_cfg["session_ttl"])
+_sessions_lock = threading.Lock()
+_executor = None
+
+def live_disabled_reason():
+    """实时预摘要不可用的原因，可用时返回 None"""
+    if not _live_cfg["enabled"]:
+        return "Live pre-summarization is disabled, set LIVE_PRESUMMARIZE=true"
+    if _live_cfg["workers"] > 1:
+        return f"Live pre-summarization keeps state in process memory and requires WEB_CONCURRENCY=1 (current: {_live_cfg['workers']})"
+    return None
+
+def check_live_mode():
+    """启动时检查: 开启了 LIVE_PRESUMMARIZE 但不满足条件时记录错误，实时预摘要不生效"""
+    reason = live_disabled_reason()
+    if _live_cfg["enabled"] and reason is not None:
+        logging.error(reason)
+
+def get_live_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    with _sessions_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(_live_cfg["concurrency"], thread_name_prefix="live")
+        return _executor
+
+def shutdown_live():
+    """worker 退出时丢弃尚未开始的预摘要任务"""
+    global _executor
+    with _sessions_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def get_live_session(summary_id: str, language: str = None):
+    session = _sessions.get(summary_id)
+    if session is None and language is not None:
+        with _sessions_lock:
+            session = _sessions.get(summary_id)
+            if session is None:
+                session = LiveSession(summary_id, language, _live_cfg)
+                _sessions.set(summary_id, session)
+    return session
+
+def summarize_window(session: LiveSession, start: int, end: int, content: str):
+    """后台生成单个窗口的摘要，prompt 与同窗口的 time 标记一致"""
+    try:
+        if not content:
+            return
+        llm_cfg = get_llm_config("meeting")
+        prompt = compile_prompt(llm_cfg["prompt_template"], REQUIRED_PLACEHOLDERS["mark_summary"]).render(
+            meeting_content=content, language=session.language
+        )
+        route = get_llm_config("meeting", "mark_summary", text=prompt)
+        with track_usage() as tracker:
+            summary = call_llm_api(prompt, None, route["model"], route["api_key"], route["api_url"])
+        if tracker.total_calls:
+            save_usage(session.summary_id, "live_presummarize", tracker)
+        session.store(start, {"start": start, "end": end, "content": content, "prompt": prompt, "summary": summary})
+    except Exception as e:
+        logging.error(f"Live pre-summarization failed for {session.summary_id} [{start}-{end}]: {str(e)}")
+    finally:
+        with session.lock:
+            session.pending -= 1
+
+def summarize_from_live(summary_id: str, language: str, start: int, end: int):
+    """
+    用预摘要回答 [start, end] 的 time 标记，返回 {"content", "prompt", "summary", "live"} 或 None(走常规流程)。
+    预摘要窗口必须从标记开头覆盖: 结尾超出时用预摘要 + 之后的转写行增量生成，开头不在任何窗口内时走常规流程。
+    """
+    if live_disabled_reason() is not None:
+        return None
+    session = get_live_session(summary_id)
+    if session is None or session.language != language:
+        return None
+    window = session.covering_window(start, end)
+    if window is None:
+        return None
+    live = {"window_start": window["start"], "window_end": window["end"], "incremental": False}
+    if window["start"] <= start <= end <= window["end"]:
+        return {"content": window["content"], "prompt": window["prompt"], "summary": window["summary"], "live": live}
+    tail = session.tail_content(window["end"], end)
+    if tail is None:
+        return None
+    if not tail:
+        return {"content": window["content"], "prompt": window["prompt"], "summary": window["summary"], "live": live}
+    prompt = compile_prompt(LIVE_INCREMENTAL_PROMPT).render(
+        previous_summary=window["summary"], meeting_content=tail, language=language
+    )
+    route = get_llm_config("meeting", "mark_summary", text=prompt)
+    try:
+        summary = call_llm_api(prompt, None, route["model"], route["api_key"], route["api_url"])
+    except Exception as e:
+        logging.error(f"Live incremental summary failed, fallback to full window: {str(e)}")
+        return None
+    live["incremental"] = True
+    return {"content": window["content"] + "\n" + tail, "prompt": prompt, "summary": summary, "live": live}
+
+@router.post("/live/{summary_id}/lines")
+def feed_live_lines(summary_id: str, request: LiveLinesRequest):
+    """推送实时转写行; 凑满的窗口在后台生成摘要，接口立即返回"""
+    reason = live_disabled_reason()
+    if reason is not None:
+        return {"error": reason}
+    session = get_live_session(summary_id, request.language)
+    ready = session.feed(list(iter_bracket_text(request.content)))
+    executor = get_live_executor()
+    for start, end, content in ready:
+        executor.submit(summarize_window, session, start, end, content)
+    return {"summary_id": summary_id, "scheduled": [{"start": start, "end": end} for start, end, _ in ready]}
+
+@router.get("/live/{summary_id}")
+def live_status(summary_id: str):
+    session = get_live_session(summary_id)
+    if session is None:
+        return {"error": f"Live session not found: {summary_id}"}
+    return session.status()
+
+@router.delete("/live/{summary_id}")
+def end_live(summary_id: str):
+    """会议结束后释放缓冲和窗口摘要"""
+    if _sessions.pop(summary_id) is None:
+        return {"error": f"Live session not found: {summary_id}"}
+    return {"deleted": summary_id}
@@ -1,13 +1,21 @@
+import json
 import logging
-from fastapi import APIRouter
+from fastapi import APIRouter, Header
 from pydantic import BaseModel, Field
 from enum import Enum
 import requests
 from marknote.config import get_llm_config
 from marknote.database.mysql_client import insert_mark_note_summary
-from marknote.api import call_llm_api
+from marknote.api import call_llm_api, get_http_session
+from marknote.images import extract_image_contents
+from marknote.live import summarize_from_live
+from marknote.transcript import iter_bracket_text, format_speaker_line, transcript_window
+from marknote.prompts import PromptTemplate, REQUIRED_PLACEHOLDERS, compile_prompt, resolve_prompt
+from marknote.singleflight import run_idempotent
+from marknote.usage import run_with_usage
+from marknote.profiling import ProfilingRoute
 
-router = APIRouter()
+router = APIRouter(route_class=ProfilingRoute)
 
 class Scenario(str, Enum):
     meeting = "meeting"
@@ -23,96 +31,115 @@ class MarkNoteSummaryRequest(BaseModel):
     language: str = Field(..., description="语言，如chinese, english等")
     mark_time: int = Field(..., description="标记时间")
     time_range: int = Field(..., description="时间范围")
-    content: str = Field(..., description="转写内容")
+    content: str = Field(None, description="转写内容, 与 transcript_id 二选一")
+    transcript_id: str = Field(None, description="POST /transcript 返回的转写ID, 提供时按 mark_time±time_range 截取窗口")
     prompt: str = Field(None, description="自定义提示内容, 可选")
+    prompt_id: str = Field(None, description="注册表中的模板ID(name 或 name:version), 可选, 优先于 prompt")
     mark_type: MarkType = Field(..., description="标记类型: time, text, image")
     image_url: list = Field(None, description="图片的地址列表, 仅image类型需要")
     notes: str = Field(None, description="用户笔记内容, 仅text类型需要")
 
 def parse_meeting_content(mark_time: int, time_range: int, content: str) -> str:
     """解析会议内容，返回窗口内的文本"""
-    parsed_lines = []
-    for line in content.strip().split('\n'):
-        if not line:
-            continue
-        time_start = line.find('[')
-        time_end = line.find(']', time_start)
-        speaker_start = line.find('[', time_end + 1)
-        speaker_end = line.find(']', speaker_start)
-        if -1 in (time_start, time_end, speaker_start, speaker_end):
-            continue
-        time_text = line[time_start+1:time_end]
-        speaker = line[speaker_start+1:speaker_end]
-        text_content = line[speaker_end+1:].strip()
-        try:
-            start, end = map(int, time_text.split('-'))
-        except ValueError:
-            continue
-        parsed_lines.append({
-            "start": start,
-            "end": end,
-            "speaker": speaker,
-            "content": text_content
-        })
     window_start = mark_time - time_range
     window_end = mark_time + time_range
-    window_results = [f"{line['speaker']}: {line['content']}" for line in parsed_lines if line["end"] >= window_start and line["start"] <= window_end]
+    window_results = [format_speaker_line(line) for line in iter_bracket_text(content) if line.end >= window_start and line.start <= window_end]
     return window_start, window_end, "\n".join(window_results)
 
 def build_prompt(llm_cfg, prompt, meeting_content, language, image_content=None, user_notes=None):
+    """prompt 可以是已编译的模板、自定义 prompt 字符串或 None(使用场景默认模板)"""
     logging.info(f"image_content: {image_content}, user_notes: {user_notes}")
-    if prompt is None:
-        prompt = llm_cfg["prompt_template"]
-    if image_content is None:
-        image_content = []
-    if user_notes is None:
-        user_notes = ""
-    if "{{meeting_content}}" not in prompt or "{{language}}" not in prompt:
-        logging.error("Prompt template must contain {{meeting_content}} and {{language}} placeholders")
-        raise ValueError("Prompt template must contain {{meeting_content}} and {{language}} placeholders")
-    format_prompt = prompt.replace("{{meeting_content}}", meeting_content).replace("{{language}}", language)
-    format_prompt = format_prompt.replace("{{user_notes}}", user_notes)
-    # format_prompt = format_prompt.replace("{{image_content}}", ", ".join(image_content) if image_content else "")
-    return format_prompt
+    if not isinstance(prompt, PromptTemplate):
+        if prompt is None:
+            prompt = llm_cfg["prompt_template"]
+        prompt = compile_prompt(prompt, REQUIRED_PLACEHOLDERS["mark_summary"])
+    image_text = format_image_content(image_content or [])
+    if image_text and "image_content" not in prompt.placeholders:
+        # 自定义 prompt 未声明图片占位符时，把图片内容附在末尾，避免丢失图片信息
+        prompt = compile_prompt(prompt.text + "\n\n#### Image Content:\n----------\n{{image_content}}\n----------")
+    return prompt.render(
+        meeting_content=meeting_content,
+        language=language,
+        user_notes=user_notes,
+        image_content=image_text
+    )
+
+def format_image_content(image_content: list) -> str:
+    """把逐张提取的图片描述拼成 {{image_content}} 的文本"""
+    if len(image_content) == 1:
+        return image_content[0]
+    return "\n\n".join(f"Image {idx}:\n{text}" for idx, text in enumerate(image_content, 1))
 
 @router.post("/mark_note/summary")
-def mark_note_summary(request: MarkNoteSummaryRequest):
+def mark_note_summary(request: MarkNoteSummaryRequest, idempotency_key: str = Header(None, alias="Idempotency-Key")):
+    return run_idempotent(
+        "mark_note_summary",
+        idempotency_key,
+        request,
+        lambda: run_with_usage(request.summary_id, "mark_note_summary", lambda: summarize_mark_note(request))
+    )
+
+def summarize_mark_note(request: MarkNoteSummaryRequest):
     import logging
     try:
         llm_cfg = get_llm_config(request.scenario)
-        api_url = llm_cfg["api_url"]
-        model = llm_cfg["model"]
-        api_key = llm_cfg["api_key"]
         user_notes = None
         image_url = None
+        image_content = None
         if request.mark_type == MarkType.image:
             if not request.image_url or not isinstance(request.image_url, list):
                 logging.error("image type must provide image_url as a list")
                 return {"error": "image type must provide image_url as a list"}
             image_url = request.image_url
+            # 图片先逐张并发提取为文本描述(带缓存)，主 summary 调用只处理文本
+            image_results = extract_image_contents(image_url, request.language)
+            image_content = [item["summary"] for item in image_results if "summary" in item]
+            if not image_content:
+                return {"error": f"Image content extraction failed: {image_results[0]['error']}"}
         elif request.mark_type == MarkType.text:
             user_notes = request.notes
+        elif not request.prompt and not request.prompt_id:
+            # 录音中已有该时间段的预摘要时直接返回，不在用户等待路径上调用完整摘要
+            live = summarize_from_live(request.summary_id, request.language, request.mark_time - request.time_range, request.mark_time + request.time_range)
+            if live is not None:
+                return finish_mark_note(request, live["content"], live["prompt"], live["summary"], None, None, live=live["live"])
+        if request.transcript_id:
+            try:
+                meeting_content = transcript_window(request.transcript_id, request.mark_time - request.time_range, request.mark_time + request.time_range)
+            except (ValueError, FileNotFoundError) as e:
+                logging.error(f"Transcript load failed: {str(e)}")
+                return {"error": f"Transcript load failed: {str(e)}"}
+        elif request.content is not None:
+            meeting_content = request.content
+        else:
+            return {"error": "content or transcript_id is required"}
         # try:
             # window_start, window_end, meeting_content = parse_meeting_content(request.mark_time, request.time_range, request.content)
         # except Exception as e:
         #     logging.error(f"Meeting content parsing failed: {str(e)}")
         #     return {"error": f"Meeting content parsing failed: {str(e)}"}
         try:
+            template = resolve_prompt(request.prompt_id, request.prompt, llm_cfg["prompt_template"], "mark_summary")
             format_prompt = build_prompt(
                 llm_cfg,
-                request.prompt,
-                request.content,
+                template,
+                meeting_content,
                 request.language,
-                image_content=image_url,
+                image_content=image_content,
                 user_notes=user_notes
             )
         except Exception as e:
             logging.error(f"Prompt build failed: {str(e)}")
             return {"error": f"Prompt build failed: {str(e)}"}
+        # 按渲染后 prompt 的 token 数选择模型，短窗口走更快的模型
+        llm_route = get_llm_config(request.scenario, "mark_summary", text=format_prompt)
+        api_url = llm_route["api_url"]
+        model = llm_route["model"]
+        api_key = llm_route["api_key"]
         try:
             logging.info(f"Calling LLM API: {api_url} with model: {model}")
             logging.info(f"Prompt content: {format_prompt}")
-            llm_response = call_llm_api(format_prompt, image_url, model, api_key, api_url)
+            llm_response = call_llm_api(format_prompt, None, model, api_key, api_url)
             logging.info(f"LLM API response: {llm_response}")
         except requests.RequestException as e:
             logging.error(f"LLM API request failed: {str(e)}")
@@ -120,6 +147,31 @@ def mark_note_summary(request: MarkNoteSummaryRequest):
         except Exception as e:
             logging.error(f"LLM API call exception: {str(e)}")
             return {"error": f"LLM API call exception: {str(e)}"}
+        return finish_mark_note(request, meeting_content, format_prompt, llm_response, image_url, user_notes)
+    except Exception as e:
+        logging.error(f"Internal server error: {str(e)}")
+        return {"error": f"Internal server error: {str(e)}"}
+
+def parse_image_urls(value: str) -> list:
+    """
+    还原 mark_note_summary.image_url 中的地址列表: 新数据为 JSON 数组;
+    旧数据为逗号拼接，data: URL 内部(媒体类型与数据之间)的逗号不作为分隔符。
+    """
+    if not value:
+        return []
+    if value.startswith("["):
+        return json.loads(value)
+    urls = []
+    for part in value.split(","):
+        if urls and urls[-1].startswith("data:") and "," not in urls[-1]:
+            urls[-1] += "," + part
+        else:
+            urls.append(part)
+    return urls
+
+def finish_mark_note(request: MarkNoteSummaryRequest, meeting_content, format_prompt, llm_response, image_url, user_notes, live=None):
+    """存储摘要、通知回调并构造响应"""
+    try:
         # 存储到MySQL
         try:
             insert_mark_note_summary({
@@ -128,14 +180,14 @@ def mark_note_summary(request: MarkNoteSummaryRequest):
                 "language": request.language,
                 "mark_time": request.mark_time,
                 "time_range": request.time_range,
-                "content": request.content,
+                "content": meeting_content,
                 "prompt": format_prompt,
                 "mark_type": request.mark_type.value,
-                "image_url": ",".join(image_url) if image_url else None,
+                "image_url": json.dumps(image_url, ensure_ascii=False) if image_url else None,
                 "user_notes": user_notes,
                 "mark_note": llm_response,
-                # "start_time": window_start,
-                # "end_time": window_end
+                "start_time": request.mark_time - request.time_range,
+                "end_time": request.mark_time + request.time_range
             })
         except Exception as e:
             logging.error(f"Failed to insert summary to MySQL: {str(e)}")
@@ -145,13 +197,15 @@ def mark_note_summary(request: MarkNoteSummaryRequest):
             # "start_time": window_start,
             # "end_time": window_end,
         }
+        if live is not None:
+            result["live"] = live
         callback_url = "http://127.0.0.1:8080/mark_note/callback"
         callback_data = {
             "summary_id": request.summary_id,
             "mark_time": request.mark_time
         }
         try:
-            requests.post(callback_url, json=callback_data, timeout=3)
+            get_http_session().post(callback_url, json=callback_data, timeout=3)
         except Exception as e:
             logging.error(f"Callback failed: {str(e)}")
             result["callback_error"] = f"Callback failed: {str(e)}"
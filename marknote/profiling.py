@@ -0,0 +1,304 @@
+"""
+按需的单请求性能剖析。
+
+开启 PROFILING_ENABLED 后，携带 X-Profile 请求头(如 "1"、"cprofile"、"pyinstrument,memory")或按
+PROFILE_SAMPLE_RATE 抽样的请求会被剖析: CPU 使用 pyinstrument(已安装时)或 cProfile，
+memory 使用 tracemalloc 快照。结果保存在 PROFILE_DIR，最多保留 PROFILE_MAX_FILES 份，
+通过 /admin/profiles 查看和下载，响应头 X-Profile-Id 为本次结果的ID。
+CPU 剖析在进程内逐个进行，其他请求正在剖析时本次请求只记录内存和耗时。
+
+同步接口在线程池中执行，中间件所在的事件循环线程采不到它们的调用栈，因此 CPU 剖析由
+ProfilingRoute 包装的接口函数在执行线程内完成，中间件只负责决定是否剖析、内存快照和保存结果。
+"""
+import asyncio
+import contextvars
+import functools
+import io
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+import anyio.to_thread
+from fastapi.routing import APIRoute
+from marknote.config import get_profile_config
+
+_profile_cfg = get_profile_config()
+_current_profile = contextvars.ContextVar("profile_session", default=None)
+_tracemalloc_lock = threading.Lock()
+# 同一进程同时只能有一个 cProfile 在采集(3.12 起第二个 enable() 抛 ValueError)，CPU 剖析逐个进行
+_cpu_profile_lock = threading.Lock()
+_tracemalloc_users = 0
+
+class ProfileSession:
+    def __init__(self, method: str, path: str, profiler: str, memory: bool):
+        self.profile_id = time.strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:8]
+        self.method = method
+        self.path = path
+        self.profiler = profiler
+        self.memory = memory
+        self.started_at = time.time()
+        self.cpu = None
+        self.status = None
+
+def default_profiler() -> str:
+    try:
+        import pyinstrument
+        return "pyinstrument"
+    except ImportError:
+        return "cprofile"
+
+_PROFILE_OFF = {"0", "false", "off", "no"}
+
+def parse_profile_header(value: str):
+    """X-Profile 请求头 -> (profiler, memory); "1"/"true" 使用默认剖析器，空值和 "0"/"false"/"off"/"no" 不剖析"""
+    options = {item.strip().lower() for item in value.split(",") if item.strip()} - _PROFILE_OFF
+    if "cprofile" in options:
+        profiler = "cprofile"
+    elif options - {"memory"}:
+        # pyinstrument 未安装时退回 cProfile
+        profiler = default_profiler()
+    else:
+        profiler = None
+    return profiler, "memory" in options
+
+class CpuProfiler:
+    """pyinstrument 与 cProfile 的统一封装"""
+    def __init__(self, kind: str, async_mode: bool):
+        self.kind = kind
+        if kind == "pyinstrument":
+            from pyinstrument import Profiler
+            self._profiler = Profiler(async_mode="enabled" if async_mode else "disabled")
+        else:
+            import cProfile
+            self._profiler = cProfile.Profile()
+
+    def start(self):
+        if self.kind == "pyinstrument":
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self, top: int) -> dict:
+        """停止并返回 {"profiler", "text", "ext", "data"}，data 为可下载的原始结果"""
+        if self.kind == "pyinstrument":
+            self._profiler.stop()
+            return {
+                "profiler": "pyinstrument",
+                "text": self._profiler.output_text(unicode=True, color=False),
+                "ext": "html",
+                "data": self._profiler.output_html().encode("utf-8"),
+            }
+        import marshal
+        import pstats
+        self._profiler.disable()
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=stream)
+        stats.sort_stats("cumulative").print_stats(top)
+        # 与 Profile.dump_stats 相同的格式，可用 pstats / snakeviz 打开
+        return {"profiler": "cprofile", "text": stream.getvalue(), "ext": "prof", "data": marshal.dumps(stats.stats)}
+
+def start_cpu_profile(session: ProfileSession, async_mode: bool):
+    """开始 CPU 剖析; 其他请求正在剖析或启动失败时返回 None，本次请求只缺少 CPU 结果"""
+    if not _cpu_profile_lock.acquire(blocking=False):
+        logging.info(f"CPU profiler busy, skip CPU profile of {session.profile_id}")
+        return None
+    try:
+        profiler = CpuProfiler(session.profiler, async_mode)
+        profiler.start()
+        return profiler
+    except Exception as e:
+        _cpu_profile_lock.release()
+        logging.error(f"Start CPU profile {session.profile_id} failed: {str(e)}")
+        return None
+
+def stop_cpu_profile(session: ProfileSession, profiler: CpuProfiler):
+    try:
+        session.cpu = profiler.stop(_profile_cfg["top"])
+    except Exception as e:
+        logging.error(f"Stop CPU profile {session.profile_id} failed: {str(e)}")
+    finally:
+        _cpu_profile_lock.release()
+
+def profiled(endpoint):
+    """在接口函数执行的线程(或协程)内做 CPU 剖析; 当前请求未开启剖析时直接调用"""
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            session = _current_profile.get()
+            if session is None or session.profiler is None or session.cpu is not None:
+                return await endpoint(*args, **kwargs)
+            # 协程期间事件循环上其他请求的调用也会计入 cProfile 结果
+            profiler = start_cpu_profile(session, async_mode=True)
+            if profiler is None:
+                return await endpoint(*args, **kwargs)
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                stop_cpu_profile(session, profiler)
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        session = _current_profile.get()
+        if session is None or session.profiler is None or session.cpu is not None:
+            return endpoint(*args, **kwargs)
+        profiler = start_cpu_profile(session, async_mode=False)
+        if profiler is None:
+            return endpoint(*args, **kwargs)
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            stop_cpu_profile(session, profiler)
+    return wrapper
+
+class ProfilingRoute(APIRoute):
+    """APIRouter(route_class=ProfilingRoute) 下的接口支持按请求剖析"""
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, profiled(endpoint), **kwargs)
+
+def start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracemalloc_users += 1
+        tracemalloc.reset_peak()
+    return tracemalloc.take_snapshot()
+
+def stop_tracemalloc(before, top: int) -> dict:
+    """对比请求前后的快照; tracemalloc 为进程级，同时进行的其他请求的分配也会计入"""
+    global _tracemalloc_users
+    after = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+    stats = after.compare_to(before, "lineno")
+    return {
+        "current_bytes": current,
+        "peak_bytes": peak,
+        "top": [str(stat) for stat in stats[:top]],
+    }
+
+def profile_path(profile_dir: str, profile_id: str, ext: str) -> str:
+    if not re.fullmatch(r"[0-9]{14}-[0-9a-f]{8}", profile_id or ""):
+        raise ValueError(f"Invalid profile_id: {profile_id}")
+    return os.path.join(profile_dir, f"{profile_id}.{ext}")
+
+def save_profile(session: ProfileSession, duration: float, memory: dict) -> dict:
+    cfg = _profile_cfg
+    os.makedirs(cfg["dir"], exist_ok=True)
+    meta = {
+        "profile_id": session.profile_id,
+        "method": session.method,
+        "path": session.path,
+        "status": session.status,
+        "created_at": session.started_at,
+        "duration": round(duration, 4),
+        "profiler": session.cpu["profiler"] if session.cpu else None,
+        "file": None,
+        "cpu": session.cpu["text"] if session.cpu else None,
+        "memory": memory,
+    }
+    if session.cpu:
+        meta["file"] = os.path.basename(profile_path(cfg["dir"], session.profile_id, session.cpu["ext"]))
+        write_atomic(os.path.join(cfg["dir"], meta["file"]), session.cpu["data"])
+    write_atomic(profile_path(cfg["dir"], session.profile_id, "json"), json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+    cleanup_profiles(cfg["dir"], cfg["max_files"])
+    return meta
+
+def write_atomic(path: str, data: bytes):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def cleanup_profiles(profile_dir: str, max_files: int):
+    """按创建时间只保留最近 max_files 份结果(元数据与原始结果一起删除)"""
+    ids = sorted(name[:-len(".json")] for name in os.listdir(profile_dir) if name.endswith(".json"))
+    for profile_id in ids[:max(len(ids) - max_files, 0)]:
+        for entry in os.scandir(profile_dir):
+            if entry.name.startswith(profile_id + "."):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+def list_profiles() -> list:
+    profile_dir = _profile_cfg["dir"]
+    if not os.path.isdir(profile_dir):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(profile_dir), reverse=True):
+        if name.endswith(".json"):
+            with open(os.path.join(profile_dir, name), encoding="utf-8") as f:
+                meta = json.load(f)
+            meta.pop("cpu", None)
+            meta["memory"] = {key: value for key, value in (meta["memory"] or {}).items() if key != "top"} or None
+            profiles.append(meta)
+    return profiles
+
+def load_profile(profile_id: str) -> dict:
+    with open(profile_path(_profile_cfg["dir"], profile_id, "json"), encoding="utf-8") as f:
+        return json.load(f)
+
+def profile_file(profile_id: str) -> str:
+    """原始 CPU 剖析结果的路径"""
+    meta = load_profile(profile_id)
+    if not meta["file"]:
+        raise FileNotFoundError(f"Profile {profile_id} has no CPU profile")
+    return os.path.join(_profile_cfg["dir"], meta["file"])
+
+class ProfilingMiddleware:
+    """ASGI 中间件: 决定请求是否剖析，记录内存快照，请求结束后在线程池中保存结果"""
+    def __init__(self, app):
+        self.app = app
+
+    def select(self, scope):
+        """返回 (profiler, memory)，不剖析时返回 None"""
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        value = headers.get("x-profile")
+        if value is not None:
+            # 与管理接口相同，请求头触发的剖析需要 ADMIN_TOKEN
+            admin_token = os.getenv("ADMIN_TOKEN")
+            if not admin_token or headers.get("x-admin-token") != admin_token:
+                return None
+            return parse_profile_header(value)
+        if _profile_cfg["sample_rate"] > 0 and random.random() < _profile_cfg["sample_rate"]:
+            return default_profiler(), _profile_cfg["memory"]
+        return None
+
+    async def __call__(self, scope, receive, send):
+        selected = self.select(scope) if _profile_cfg["enabled"] and scope["type"] == "http" else None
+        if selected is None or selected == (None, False):
+            await self.app(scope, receive, send)
+            return
+        session = ProfileSession(scope["method"], scope["path"], *selected)
+        # 大堆上的快照和对比耗时较长，放到线程池中执行，不阻塞事件循环上的其他请求
+        snapshot = await anyio.to_thread.run_sync(start_tracemalloc) if session.memory else None
+        token = _current_profile.set(session)
+        started = time.perf_counter()
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                session.status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", session.profile_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _current_profile.reset(token)
+            duration = time.perf_counter() - started
+            try:
+                memory = await anyio.to_thread.run_sync(stop_tracemalloc, snapshot, _profile_cfg["top"]) if snapshot is not None else None
+                await anyio.to_thread.run_sync(save_profile, session, duration, memory)
+            except Exception as e:
+                logging.error(f"Save profile {session.profile_id} failed: {str(e)}")
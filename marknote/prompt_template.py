@@ -128,6 +128,14 @@ MEETING_SUMMARY_PROMPT_V4 = (
     "#### Image Content (OPTIONAL):\n----------\n{{image_content}}\n----------"
 )
 
+LIVE_INCREMENTAL_PROMPT = (
+    "You are an efficient meeting information extraction expert. Below is the summary of a meeting excerpt, followed by the transcript that came right after it. "
+    "Update the summary so that it also covers the new transcript: merge new information into the existing topics, add new topics, action items and conclusions where needed, "
+    "and keep the original format and structure. Output only the updated summary in {{language}}, without any explanation.\n\n"
+    "#### Previous Summary:\n{{previous_summary}}\n\n"
+    "#### New Transcript:\n{{meeting_content}}"
+)
+
 SEGMENT_SUMMARY_PROMPT = (
     "Summarize the following meeting segment in 1-2 sentences:\n{{meeting_summaries}}"
 )
@@ -232,6 +240,25 @@ EXTENSION_PROMPT = (
     "#### Meeting Context (Optional):\n{{meeting_context}}"
 )
 
+BATCH_EXTENSION_PROMPT = (
+    "# Role: AI Meeting Note Expander\n\n"
+    "You are a professional AI assistant specializing in expanding user-inputted meeting notes. Expand **each** note below into a complete, professional sentence suitable for official meeting minutes.\n\n"
+    "---\n\n"
+    "### **Expansion Principles (You MUST strictly follow these)**\n\n"
+    "1.  **Preserve the Core**: Key terms, numbers, names, and project titles from each note MUST be embedded, unchanged, within its expanded sentence. Never distort or guess the user's original intent.\n"
+    "2.  **Subjectless Notes**: If a note describes an action but does not specify a person, assume the task is for the note-taker themself and use a first-person perspective.\n"
+    "3.  **Professional Context**: For notes that are not personal tasks, use neutral business phrasing, such as: \"It was confirmed that...\", \"A consensus was reached that...\".\n"
+    "4.  **Leverage Context**: If the meeting context is provided, use it to make each sentence more specific.\n"
+    "5.  **Independence**: Expand every note independently, in the same language as that note. Do not merge, skip, or reorder notes.\n\n"
+    "---\n\n"
+    "### **Output Requirements**\n\n"
+    "* **Format**: Output a JSON array only, without code fences or any other text.\n"
+    "* Each element is `{\"id\": \"<id of the note>\", \"extended_text\": \"<the expanded sentence>\"}`, exactly one element per input note.\n\n"
+    "---\n\n"
+    "#### Notes (JSON array of id and note):\n{{notes}}\n\n"
+    "#### Meeting Context (Optional):\n{{meeting_context}}"
+)
+
 IMAGE_PROMPT = (
     "# Role: AI Image Content Extraction Specialist\n\n"
     "You are a top-tier AI analysis assistant with powerful computer vision and information processing capabilities. Your mission is to accurately and comprehensively extract all key information from user-uploaded images and present it in a structured, easy-to-understand format.\n\n"
@@ -0,0 +1,195 @@
+"""
+prompt 模板注册表。
+
+模板以 name + version 标识，来源依次为 prompt_template.py 中的内置常量、PROMPT_DIR 目录
+(<name>/<version>.txt)和 prompt_template 表，后加载的同名同版本覆盖前者。
+模板在加载时切分为文本段和占位符，只编译一次；请求中用 prompt_id("name" 取最新版本，
+"name:version" 取指定版本)引用，不必每次携带完整 prompt。
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from marknote import prompt_template
+from marknote.cache import TTLCache
+from marknote.config import get_prompt_config
+
+_PLACEHOLDER = re.compile(r"\{\{(\w+)\}\}")
+_VERSION_SUFFIX = re.compile(r"^(.+)_V(\d+)$")
+PROMPT_NAME = re.compile(r"[A-Za-z0-9_\-.]{1,128}")
+
+# 各接口的自定义 prompt 必须包含的占位符
+REQUIRED_PLACEHOLDERS = {
+    "mark_summary": ("meeting_content", "language"),
+    "full_text": ("section_summaries",),
+    "extension": ("user_note",),
+    "image": (),
+}
+
+class PromptTemplate:
+    """编译后的模板: 按占位符切分为文本段，渲染时一次拼接，不对已替换的内容再做替换"""
+    def __init__(self, text: str, name: str = None, version: int = None, source: str = "inline"):
+        self.text = text
+        self.name = name
+        self.version = version
+        self.source = source
+        self._parts = _PLACEHOLDER.split(text)
+        self.placeholders = frozenset(self._parts[1::2])
+
+    @property
+    def prompt_id(self) -> str:
+        return f"{self.name}:{self.version}"
+
+    def validate(self, required) -> "PromptTemplate":
+        missing = [name for name in required if name not in self.placeholders]
+        if missing:
+            placeholders = " and ".join("{{" + name + "}}" for name in missing)
+            raise ValueError(f"Prompt template must contain {placeholders} placeholders")
+        return self
+
+    def render(self, **values) -> str:
+        """填充占位符，未提供的占位符替换为空字符串"""
+        parts = self._parts[:]
+        parts[1::2] = [values.get(name) or "" for name in self._parts[1::2]]
+        return "".join(parts)
+
+    def info(self) -> dict:
+        return {
+            "prompt_id": self.prompt_id,
+            "name": self.name,
+            "version": self.version,
+            "source": self.source,
+            "placeholders": sorted(self.placeholders),
+            "length": len(self.text),
+        }
+
+def parse_prompt_id(prompt_id: str):
+    """"name:version" -> (name, version); 只有 name 时 version 为 None(取最新版本)"""
+    name, sep, version = prompt_id.partition(":")
+    if sep:
+        try:
+            return name, int(version)
+        except ValueError:
+            raise KeyError(f"Invalid prompt_id: {prompt_id}")
+    return name, None
+
+def builtin_prompts() -> list:
+    """prompt_template.py 中的常量，FOO_V2 注册为 FOO 的第 2 版，无后缀为第 1 版"""
+    templates = []
+    for attr, text in vars(prompt_template).items():
+        if not attr.isupper() or not isinstance(text, str):
+            continue
+        match = _VERSION_SUFFIX.match(attr)
+        name, version = (match.group(1), int(match.group(2))) if match else (attr, 1)
+        templates.append(PromptTemplate(text, name, version, "builtin"))
+    return templates
+
+def load_prompt_dir(prompt_dir: str) -> list:
+    templates = []
+    if not prompt_dir or not os.path.isdir(prompt_dir):
+        return templates
+    for entry in os.scandir(prompt_dir):
+        if not entry.is_dir() or not PROMPT_NAME.fullmatch(entry.name):
+            continue
+        for file in os.scandir(entry.path):
+            version, ext = os.path.splitext(file.name)
+            if not file.is_file() or ext != ".txt" or not version.isdigit():
+                continue
+            with open(file.path, encoding="utf-8") as f:
+                templates.append(PromptTemplate(f.read(), entry.name, int(version), "file"))
+    return templates
+
+def load_db_prompts() -> list:
+    from marknote.database.mysql_client import get_prompt_templates
+    return [PromptTemplate(row["template"], row["name"], int(row["version"]), "db") for row in get_prompt_templates()]
+
+class PromptRegistry:
+    def __init__(self, templates: list, refresh_interval: float = 0):
+        self.refresh_interval = refresh_interval
+        self._templates = {}
+        self._latest = {}
+        for template in templates:
+            self._templates[(template.name, template.version)] = template
+        for name, version in self._templates:
+            if version > self._latest.get(name, 0):
+                self._latest[name] = version
+        self.loaded_at = time.monotonic()
+
+    def get(self, prompt_id: str) -> PromptTemplate:
+        name, version = parse_prompt_id(prompt_id)
+        if version is None:
+            version = self._latest.get(name)
+            if version is None:
+                # 兼容直接使用内置常量名，如 MEETING_SUMMARY_PROMPT_V4
+                match = _VERSION_SUFFIX.match(name)
+                if match:
+                    name, version = match.group(1), int(match.group(2))
+        template = self._templates.get((name, version))
+        if template is None:
+            raise KeyError(f"Prompt not found: {prompt_id}")
+        return template
+
+    def list(self) -> list:
+        return [self._templates[key].info() for key in sorted(self._templates)]
+
+    def __len__(self):
+        return len(self._templates)
+
+_registry = None
+_registry_lock = threading.Lock()
+_compiled_cache = TTLCache(get_prompt_config()["cache_size"], 24 * 3600)
+
+def load_prompts() -> PromptRegistry:
+    """加载全部来源的模板; 目录或数据库读取失败时只记录错误，保留其他来源"""
+    cfg = get_prompt_config()
+    templates = builtin_prompts()
+    try:
+        templates += load_prompt_dir(cfg["dir"])
+    except Exception as e:
+        logging.error(f"Load prompt dir {cfg['dir']} failed: {str(e)}")
+    if cfg["db_enabled"]:
+        try:
+            templates += load_db_prompts()
+        except Exception as e:
+            logging.error(f"Load prompt templates from MySQL failed: {str(e)}")
+    return PromptRegistry(templates, cfg["refresh_interval"])
+
+def reload_prompts() -> PromptRegistry:
+    global _registry
+    registry = load_prompts()
+    with _registry_lock:
+        _registry = registry
+    logging.info(f"Prompt registry loaded: {len(registry)} templates.")
+    return registry
+
+def get_prompt_registry() -> PromptRegistry:
+    """进程内共享的注册表，超过 PROMPT_REFRESH_INTERVAL 秒后在下次访问时重新加载(<=0 时不自动刷新)"""
+    registry = _registry
+    if registry is None:
+        return reload_prompts()
+    interval = registry.refresh_interval
+    if interval > 0 and time.monotonic() - registry.loaded_at > interval:
+        registry.loaded_at = time.monotonic()
+        return reload_prompts()
+    return registry
+
+def get_prompt(prompt_id: str, required=()) -> PromptTemplate:
+    return get_prompt_registry().get(prompt_id).validate(required)
+
+def compile_prompt(text: str, required=()) -> PromptTemplate:
+    """编译请求中携带的自定义 prompt，按内容哈希缓存，相同 prompt 只校验和切分一次"""
+    key = hashlib.sha256(text.encode("utf-8")).hexdigest() + "/" + ",".join(required)
+    template = _compiled_cache.get(key)
+    if template is None:
+        template = PromptTemplate(text).validate(required)
+        _compiled_cache.set(key, template)
+    return template
+
+def resolve_prompt(prompt_id: str, prompt: str, default: str, kind: str) -> PromptTemplate:
+    """按 prompt_id > 自定义 prompt > 默认模板的顺序取得编译后的模板"""
+    required = REQUIRED_PLACEHOLDERS[kind]
+    if prompt_id:
+        return get_prompt(prompt_id, required)
+    return compile_prompt(prompt if prompt else default, required)
@@ -0,0 +1,31 @@
+"""
+生产环境启动入口。
+
+- gunicorn: gunicorn -c gunicorn.conf.py main:app (使用下面的 UvicornWorker)
+- 纯 uvicorn 多进程: python -m marknote.server
+"""
+import uvicorn
+from uvicorn_worker import UvicornWorker as _UvicornWorker
+from marknote.config import get_server_config
+
+class UvicornWorker(_UvicornWorker):
+    """固定使用 uvloop + httptools，并开启 lifespan 以执行预热与资源释放"""
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "lifespan": "on"}
+
+def main():
+    cfg = get_server_config()
+    uvicorn.run(
+        "main:app",
+        host=cfg["host"],
+        port=cfg["port"],
+        workers=cfg["workers"],
+        loop="uvloop",
+        http="httptools",
+        lifespan="on",
+        backlog=cfg["backlog"],
+        timeout_keep_alive=cfg["keep_alive"],
+        timeout_graceful_shutdown=cfg["graceful_timeout"],
+    )
+
+if __name__ == "__main__":
+    main()
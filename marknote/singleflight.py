@@ -0,0 +1,114 @@
+import hashlib
+import json
+import logging
+import threading
+from fastapi.responses import JSONResponse
+from marknote.cache import TTLCache
+from marknote.config import get_idempotency_config
+from marknote.database.mysql_client import get_idempotency_result, insert_idempotency_result
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """同一 key 的并发调用只执行一次，其余调用等待并共享结果(或异常)"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        return self.do_shared(key, fn)[0]
+
+    def do_shared(self, key, fn):
+        """返回 (result, shared)，shared 为 True 表示结果来自其他调用方的执行"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+def llm_call_key(prompt: str, image_url: list, model: str, api_url: str) -> str:
+    """按渲染后的 prompt、模型、图片列表和 API 地址生成去重 key"""
+    raw = json.dumps([api_url, model, prompt, image_url or []], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+_idempotency_cfg = get_idempotency_config()
+_idempotency_results = TTLCache(_idempotency_cfg["cache_size"], _idempotency_cfg["ttl"])
+_idempotency_flight = SingleFlight()
+
+def request_body_hash(body) -> str:
+    """请求体(pydantic 模型)按字段名排序序列化后的哈希，字段顺序和空白不同的相同请求哈希一致"""
+    raw = json.dumps(body.model_dump(mode="json"), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def load_idempotent_result(scope: str, idempotency_key: str):
+    """进程内缓存未命中时从 MySQL 读取其他 worker 保存的结果，返回 (body_hash, result) 或 None"""
+    key = f"{scope}:{idempotency_key}"
+    cached = _idempotency_results.get(key)
+    if cached is not None or not _idempotency_cfg["db_enabled"]:
+        return cached
+    try:
+        row = get_idempotency_result(scope, idempotency_key)
+    except Exception as e:
+        logging.error(f"Failed to load idempotency result {key}: {str(e)}")
+        return None
+    if row is None:
+        return None
+    cached = (row["body_hash"], json.loads(row["result"]))
+    _idempotency_results.set(key, cached)
+    return cached
+
+def save_idempotent_result(scope: str, idempotency_key: str, body_hash: str, result):
+    _idempotency_results.set(f"{scope}:{idempotency_key}", (body_hash, result))
+    if not _idempotency_cfg["db_enabled"]:
+        return
+    try:
+        insert_idempotency_result(
+            scope, idempotency_key, body_hash, json.dumps(result, ensure_ascii=False, default=str), _idempotency_cfg["ttl"]
+        )
+    except Exception as e:
+        logging.error(f"Failed to save idempotency result {scope}:{idempotency_key}: {str(e)}")
+
+def run_idempotent(scope: str, idempotency_key: str, body, fn):
+    """
+    按 Idempotency-Key 执行 fn: 已有成功结果时直接返回，同一 worker 内同 key 的并发请求只执行一次。
+    结果与请求体哈希一起保存在进程内缓存和 MySQL 中，重试落到其他 worker 时也能命中;
+    同一 key 携带不同请求体时返回 422，不返回其他请求的结果。
+    返回 {"error": ...} 的结果不保存，客户端重试时会重新执行。
+    """
+    if not idempotency_key:
+        return fn()
+    key = f"{scope}:{idempotency_key}"
+    body_hash = request_body_hash(body)
+    def run():
+        cached = load_idempotent_result(scope, idempotency_key)
+        if cached is not None:
+            return cached
+        result = fn()
+        if not (isinstance(result, dict) and "error" in result):
+            save_idempotent_result(scope, idempotency_key, body_hash, result)
+        return body_hash, result
+    cached = _idempotency_results.get(key)
+    stored_hash, result = cached if cached is not None else _idempotency_flight.do(key, run)
+    if stored_hash != body_hash:
+        return JSONResponse(status_code=422, content={"error": "Idempotency-Key has already been used with a different request body"})
+    return result
@@ -0,0 +1,280 @@
+import codecs
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import time
+import uuid
+from typing import AsyncIterator, Iterable, Iterator, NamedTuple
+import anyio.to_thread
+from fastapi import APIRouter, Request
+from marknote.config import get_transcript_config
+from marknote.profiling import ProfilingRoute
+
+router = APIRouter(route_class=ProfilingRoute)
+
+class TranscriptLine(NamedTuple):
+    start: int
+    end: int
+    speaker: str
+    content: str
+
+def parse_bracket_line(line: str):
+    """解析 [start-end][speaker] content 格式的一行，格式不符时返回 None"""
+    time_start = line.find('[')
+    time_end = line.find(']', time_start)
+    speaker_start = line.find('[', time_end + 1)
+    speaker_end = line.find(']', speaker_start)
+    if -1 in (time_start, time_end, speaker_start, speaker_end):
+        return None
+    time_text = line[time_start+1:time_end]
+    try:
+        start, end = map(int, time_text.split('-'))
+    except ValueError:
+        return None
+    return TranscriptLine(start, end, line[speaker_start+1:speaker_end], line[speaker_end+1:].strip())
+
+def format_bracket_line(line: TranscriptLine) -> str:
+    return f"[{line.start}-{line.end}][{line.speaker}] {line.content}"
+
+def format_speaker_line(line: TranscriptLine) -> str:
+    return f"{line.speaker}: {line.content}" if line.speaker else line.content
+
+def iter_bracket_text(text: str) -> Iterator[TranscriptLine]:
+    """逐行解析请求体中的转写字符串，不额外构造行列表"""
+    for match in re.finditer(r"[^\n]+", text):
+        parsed = parse_bracket_line(match.group())
+        if parsed is not None:
+            yield parsed
+
+class BracketParser:
+    """当前使用的 [start-end][speaker] content 格式"""
+    def feed(self, line: str) -> list:
+        parsed = parse_bracket_line(line)
+        return [parsed] if parsed is not None else []
+
+    def close(self) -> list:
+        return []
+
+class JsonlParser:
+    """每行一个 JSON 对象: start_time/start, end_time/end, speaker, content/text; 格式不符的行跳过"""
+    def feed(self, line: str) -> list:
+        line = line.strip()
+        if not line:
+            return []
+        try:
+            item = json.loads(line)
+            start = int(item.get("start_time", item.get("start")))
+            end = int(item.get("end_time", item.get("end")))
+            content = item.get("content", item.get("text")) or ""
+            speaker = item.get("speaker") or ""
+            if not isinstance(content, str) or not isinstance(speaker, str):
+                raise TypeError("speaker and content must be strings")
+        except (ValueError, TypeError, AttributeError):
+            return []
+        return [TranscriptLine(start, end, speaker, content.strip())]
+
+    def close(self) -> list:
+        return []
+
+_VOICE_TAG = re.compile(r"<v(?:\.[^ >]*)?\s+([^>]*)>")
+_TAG = re.compile(r"<[^>]+>")
+
+def parse_timestamp(text: str) -> float:
+    """00:01:02,500 / 01:02.500 -> 秒"""
+    parts = text.strip().replace(",", ".").split(":")
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+class CueParser:
+    """
+    SRT / WebVTT 字幕块: 以空行分隔，包含 "start --> end" 时间行和若干文本行。
+    时间取整为秒(开始向下、结束向上取整)，与现有转写格式一致; WebVTT 的 <v 说话人> 标签解析为 speaker。
+    """
+    def __init__(self):
+        self._block = []
+
+    def feed(self, line: str) -> list:
+        line = line.strip()
+        if line:
+            self._block.append(line)
+            return []
+        return self.close()
+
+    def close(self) -> list:
+        block, self._block = self._block, []
+        for idx, line in enumerate(block):
+            if "-->" not in line:
+                continue
+            start_text, _, end_text = line.partition("-->")
+            try:
+                start = math.floor(parse_timestamp(start_text))
+                # WebVTT 时间行后可能带有 cue 设置，如 "align:start"
+                end = math.ceil(parse_timestamp(end_text.split()[0]))
+            except (ValueError, IndexError):
+                return []
+            text = " ".join(block[idx+1:])
+            speaker = ""
+            voice = _VOICE_TAG.search(text)
+            if voice:
+                speaker = voice.group(1).strip()
+            content = _TAG.sub("", text).strip()
+            return [TranscriptLine(start, end, speaker, content)] if content else []
+        return []
+
+PARSERS = {
+    "bracket": BracketParser,
+    "jsonl": JsonlParser,
+    "srt": CueParser,
+    "vtt": CueParser,
+}
+
+CONTENT_TYPE_FORMATS = {
+    "application/jsonl": "jsonl",
+    "application/x-ndjson": "jsonl",
+    "application/x-subrip": "srt",
+    "text/vtt": "vtt",
+}
+
+def detect_format(format: str = None, filename: str = None, content_type: str = None) -> str:
+    if format:
+        return format
+    if filename:
+        ext = os.path.splitext(filename)[-1].lower().lstrip(".")
+        if ext in PARSERS:
+            return ext
+        if ext == "ndjson":
+            return "jsonl"
+    if content_type:
+        return CONTENT_TYPE_FORMATS.get(content_type.split(";")[0].strip().lower(), "bracket")
+    return "bracket"
+
+class TranscriptWriter:
+    """把解析后的行写入紧凑的 TSV 文件(start, end, speaker, content)，完成后原子重命名"""
+    def __init__(self, store_dir: str):
+        os.makedirs(store_dir, exist_ok=True)
+        self.transcript_id = uuid.uuid4().hex
+        self.path = os.path.join(store_dir, f"{self.transcript_id}.tsv")
+        fd, self.tmp_path = tempfile.mkstemp(dir=store_dir, suffix=".part")
+        self.file = os.fdopen(fd, "w", encoding="utf-8")
+        self.lines = 0
+        self.start_time = None
+        self.end_time = None
+
+    def write_many(self, lines: Iterable[TranscriptLine]):
+        for line in lines:
+            speaker = line.speaker.replace("\t", " ")
+            content = line.content.replace("\t", " ").replace("\n", " ")
+            self.file.write(f"{line.start}\t{line.end}\t{speaker}\t{content}\n")
+            self.lines += 1
+            if self.start_time is None or line.start < self.start_time:
+                self.start_time = line.start
+            if self.end_time is None or line.end > self.end_time:
+                self.end_time = line.end
+
+    def commit(self):
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+def transcript_path(transcript_id: str) -> str:
+    if not re.fullmatch(r"[0-9a-f]{32}", transcript_id or ""):
+        raise ValueError(f"Invalid transcript_id: {transcript_id}")
+    path = os.path.join(get_transcript_config()["store_dir"], f"{transcript_id}.tsv")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Transcript not found: {transcript_id}")
+    return path
+
+def iter_transcript(transcript_id: str) -> Iterator[TranscriptLine]:
+    """流式读取已存储的转写，每次只保留一行在内存中"""
+    with open(transcript_path(transcript_id), encoding="utf-8") as f:
+        for row in f:
+            start, end, speaker, content = row.rstrip("\n").split("\t", 3)
+            yield TranscriptLine(int(start), int(end), speaker, content)
+
+def transcript_window(transcript_id: str, window_start: int, window_end: int) -> str:
+    """与 parse_meeting_content 相同的窗口规则，返回 "speaker: content" 文本"""
+    return "\n".join(
+        format_speaker_line(line) for line in iter_transcript(transcript_id)
+        if line.end >= window_start and line.start <= window_end
+    )
+
+def cleanup_transcripts(store_dir: str, ttl: int):
+    """删除超过保留时间的转写文件"""
+    deadline = time.time() - ttl
+    for entry in os.scandir(store_dir):
+        if entry.is_file() and entry.stat().st_mtime < deadline:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+async def limit_stream(chunks, max_bytes: int) -> AsyncIterator[bytes]:
+    received = 0
+    async for chunk in chunks:
+        received += len(chunk)
+        if received > max_bytes:
+            raise ValueError(f"Transcript exceeds {max_bytes} bytes")
+        yield chunk
+
+async def aiter_lines(chunks) -> AsyncIterator[list]:
+    """把字节流增量解码为文本行(按块批量产出)，跨块的行和多字节字符都能正确拼接"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        if lines:
+            yield [line.rstrip("\r") for line in lines]
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield [pending.rstrip("\r")]
+
+@router.post("/transcript")
+async def ingest_transcript(request: Request, format: str = None, filename: str = None):
+    """
+    上传转写文件(请求体即文件内容)，支持 bracket / jsonl / srt / vtt。
+    边接收边解析写入转写存储，返回 transcript_id 供 summary 接口引用。
+    """
+    fmt = detect_format(format, filename, request.headers.get("content-type"))
+    if fmt not in PARSERS:
+        return {"error": f"Unsupported transcript format: {fmt}"}
+    cfg = get_transcript_config()
+    parser = PARSERS[fmt]()
+    writer = TranscriptWriter(cfg["store_dir"])
+    try:
+        async for lines in aiter_lines(limit_stream(request.stream(), cfg["max_bytes"])):
+            parsed = [item for line in lines for item in parser.feed(line)]
+            if parsed:
+                await anyio.to_thread.run_sync(writer.write_many, parsed)
+        writer.write_many(parser.close())
+        writer.commit()
+    except Exception as e:
+        writer.abort()
+        logging.error(f"Transcript ingestion failed: {str(e)}")
+        return {"error": f"Transcript ingestion failed: {str(e)}"}
+    await anyio.to_thread.run_sync(cleanup_transcripts, cfg["store_dir"], cfg["ttl"])
+    logging.info(f"Ingested transcript {writer.transcript_id}: {writer.lines} lines ({fmt}).")
+    return {
+        "transcript_id": writer.transcript_id,
+        "format": fmt,
+        "lines": writer.lines,
+        "start_time": writer.start_time,
+        "end_time": writer.end_time,
+    }
+
+@router.delete("/transcript/{transcript_id}")
+def delete_transcript(transcript_id: str):
+    try:
+        os.remove(transcript_path(transcript_id))
+    except (ValueError, FileNotFoundError) as e:
+        return {"error": str(e)}
+    return {"deleted": transcript_id}
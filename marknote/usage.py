@@ -0,0 +1,103 @@
+import contextvars
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi import APIRouter
+from marknote.database.mysql_client import insert_llm_usage, get_llm_usage
+from marknote.profiling import ProfilingRoute
+
+router = APIRouter(route_class=ProfilingRoute)
+
+class UsageTracker:
+    """累计一次请求内所有 LLM 调用的 token 用量，map 阶段的多个线程会同时写入"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        # 与并发的相同调用共享上游结果、未实际计费的调用次数
+        self.shared_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.estimated_tokens = None
+
+    def record(self, usage: dict, shared: bool = False):
+        with self._lock:
+            if shared:
+                self.shared_calls += 1
+                return
+            self.calls += 1
+            if usage:
+                self.prompt_tokens += usage.get("prompt_tokens") or 0
+                self.completion_tokens += usage.get("completion_tokens") or 0
+
+    @property
+    def total_calls(self) -> int:
+        return self.calls + self.shared_calls
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "shared_calls": self.shared_calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.prompt_tokens + self.completion_tokens,
+                "estimated_tokens": self.estimated_tokens,
+            }
+
+_current_usage = ContextVar("llm_usage", default=None)
+
+@contextmanager
+def track_usage():
+    tracker = UsageTracker()
+    token = _current_usage.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _current_usage.reset(token)
+
+def get_current_usage():
+    return _current_usage.get()
+
+def record_usage(usage: dict, shared: bool = False):
+    """由 call_llm_api 调用，把响应中的 usage 计入当前请求; shared 时只计共享次数"""
+    tracker = _current_usage.get()
+    if tracker is not None:
+        tracker.record(usage, shared)
+
+def bind_context(fn):
+    """
+    线程池中的任务默认不继承 contextvars，包装后每次调用都在提交时上下文的副本中执行，
+    使 map 阶段的调用计入同一个 UsageTracker。
+    """
+    ctx = contextvars.copy_context()
+    def wrapper(*args, **kwargs):
+        return ctx.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+def save_usage(summary_id: str, endpoint: str, tracker: UsageTracker):
+    try:
+        insert_llm_usage({"summary_id": summary_id, "endpoint": endpoint, **tracker.to_dict()})
+    except Exception as e:
+        logging.error(f"Failed to insert llm usage to MySQL: {str(e)}")
+
+def run_with_usage(summary_id: str, endpoint: str, fn):
+    """执行 fn 并统计其间的 token 用量，附加到结果的 usage 字段; 有 summary_id 时写入 llm_usage 表"""
+    with track_usage() as tracker:
+        result = fn()
+    if isinstance(result, dict):
+        result["usage"] = tracker.to_dict()
+    if summary_id and tracker.total_calls:
+        save_usage(summary_id, endpoint, tracker)
+    return result
+
+@router.get("/usage/{summary_id}")
+def usage_by_summary_id(summary_id: str):
+    """按接口汇总某个 summary_id 的 LLM 调用次数和 token 用量"""
+    try:
+        rows = get_llm_usage(summary_id)
+    except Exception as e:
+        logging.error(f"Failed to load llm usage: {str(e)}")
+        return {"error": f"Failed to load llm usage: {str(e)}"}
+    total = {key: sum(int(row[key] or 0) for row in rows) for key in ("calls", "shared_calls", "prompt_tokens", "completion_tokens", "total_tokens")}
+    return {"summary_id": summary_id, "endpoints": rows, "total": total}
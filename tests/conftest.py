@@ -0,0 +1,13 @@
+import os
+import pytest
+
+# lifespan 中的 configure_logging 不在工作目录下写日志文件
+os.environ["LOG_DIR"] = ""
+
+ADMIN_TOKEN = "test-admin-token"
+
+@pytest.fixture
+def admin_headers(monkeypatch):
+    """管理接口和 X-Profile 需要的 ADMIN_TOKEN 请求头"""
+    monkeypatch.setenv("ADMIN_TOKEN", ADMIN_TOKEN)
+    return {"X-Admin-Token": ADMIN_TOKEN}
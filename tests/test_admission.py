@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from marknote.admission import AdmissionController, AdmissionRejected
+from main import app
+
+def make_controller(total_limit=1, **overrides):
+    classes = {
+        "summary": {"limit": 1, "max_queue": 2, "queue_timeout": 1, "priority": 0},
+        "full_text": {"limit": 1, "max_queue": 2, "queue_timeout": 1, "priority": 2},
+    }
+    for name, cfg in overrides.items():
+        classes[name].update(cfg)
+    return AdmissionController(total_limit, classes)
+
+def test_shed_when_queue_full():
+    async def run():
+        controller = make_controller(summary={"max_queue": 0})
+        await controller.acquire("summary")
+        with pytest.raises(AdmissionRejected) as exc:
+            await controller.acquire("summary")
+        assert exc.value.retry_after == 1
+        assert controller.stats()["classes"]["summary"]["shed"] == 1
+    asyncio.run(run())
+
+def test_shed_after_queue_timeout():
+    async def run():
+        controller = make_controller(summary={"queue_timeout": 0.05})
+        await controller.acquire("summary")
+        with pytest.raises(AdmissionRejected):
+            await controller.acquire("summary")
+        assert controller.stats()["classes"]["summary"]["queued"] == 0
+    asyncio.run(run())
+
+def test_higher_priority_admitted_first():
+    async def run():
+        controller = make_controller()
+        order = []
+        await controller.acquire("full_text")
+        async def waiter(name):
+            await controller.acquire(name)
+            order.append(name)
+        tasks = [asyncio.create_task(waiter("full_text"))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(waiter("summary")))
+        await asyncio.sleep(0)
+        controller.release("full_text")
+        while not order:
+            await asyncio.sleep(0.01)
+        controller.release(order[0])
+        await asyncio.gather(*tasks)
+        assert order == ["summary", "full_text"]
+    asyncio.run(run())
+
+def test_waiter_admitted_in_same_turn_as_timeout_keeps_its_slot(monkeypatch):
+    async def run():
+        controller = make_controller(total_limit=2)
+        await controller.acquire("summary")
+        async def wait_for_racing_release(fut, timeout):
+            # release 与排队截止时间落在同一轮事件循环: 等待者已被唤醒，wait_for 仍抛出超时
+            controller.release("summary")
+            assert fut.done()
+            raise asyncio.TimeoutError
+        monkeypatch.setattr(asyncio, "wait_for", wait_for_racing_release)
+        await controller.acquire("summary")
+        monkeypatch.undo()
+        stats = controller.stats()["classes"]["summary"]
+        assert (stats["in_flight"], stats["queued"], stats["shed"]) == (1, 0, 0)
+        controller.release("summary")
+        assert controller.stats()["in_flight"] == 0
+    asyncio.run(run())
+
+def test_admission_stats_endpoint(admin_headers):
+    client = TestClient(app)
+    response = client.get("/admin/admission", headers=admin_headers)
+    assert response.status_code == 200
+    assert "summary" in response.json()["classes"]
+
+def test_admin_endpoints_fail_closed_without_token(monkeypatch):
+    client = TestClient(app)
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    assert client.get("/admin/admission").status_code == 403
+    assert client.get("/admin/admission", headers={"X-Admin-Token": ""}).status_code == 403
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    assert client.get("/admin/admission", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/admin/admission", headers={"X-Admin-Token": "secret"}).status_code == 200
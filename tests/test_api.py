@@ -35,3 +35,59 @@ def test_mark_note_summary_text():
     assert response.status_code == 200
     data = response.json()
     assert "llm_summary" in data or "error" in data
+
+def test_full_text_reuses_stored_summaries(monkeypatch):
+    import marknote.full_text as full_text
+    monkeypatch.setattr(full_text, "count_tokens", lambda text, model_name: len(text.split()))
+    prompts = []
+    def fake_llm(prompt, image_url, model, api_key, api_url):
+        prompts.append(prompt)
+        return "summary"
+    monkeypatch.setattr(full_text, "call_llm_api", fake_llm)
+    monkeypatch.setattr(full_text, "get_mark_note_summaries", lambda summary_id: [
+        {"mark_time": 30, "time_range": 30, "start_time": 0, "end_time": 60, "mark_note": "已存储的摘要"}
+    ])
+    client = TestClient(app)
+    payload = {
+        "summary_id": "test789",
+        "full_text": "[0-60][张三] 这是会议内容1\n[120-180][李四] 这是会议内容2",
+        "mark_notes": []
+    }
+    response = client.post("/mark_note/full_text", json=payload)
+    assert response.status_code == 200
+    data = response.json()
+    # 只有未覆盖的片段进入 map 阶段，另外一次为最终汇总
+    assert len(prompts) == 2
+    assert "这是会议内容1" not in prompts[0]
+    assert "已存储的摘要" in prompts[-1]
+    assert data["marknote_results"][0]["summary"] == "已存储的摘要"
+
+def test_full_text_only_skips_lines_fully_inside_stored_windows():
+    from marknote.full_text import is_covered
+    stored = [
+        {"start_time": 0, "end_time": 60, "summary": "a"},
+        {"start_time": 60, "end_time": 120, "summary": "b"},
+        {"start_time": 200, "end_time": 260, "summary": "c"},
+    ]
+    assert is_covered({"start_time": 10, "end_time": 50}, stored)
+    # 跨越两个相邻窗口的行由两者连续覆盖
+    assert is_covered({"start_time": 50, "end_time": 70}, stored)
+    # 跨越窗口边界、部分在窗口外的行仍需进入 map 阶段
+    assert not is_covered({"start_time": 110, "end_time": 130}, stored)
+    assert not is_covered({"start_time": 190, "end_time": 210}, stored)
+    assert not is_covered({"start_time": 130, "end_time": 190}, stored)
+
+def test_ready_after_warm_up(monkeypatch):
+    import time
+    import marknote.lifecycle as lifecycle
+    monkeypatch.setattr(lifecycle, "warm_pool", lambda: None)
+    monkeypatch.setattr(lifecycle, "get_encoding", lambda model_name: None)
+    monkeypatch.setattr(lifecycle, "configure_logging", lambda: None)
+    with TestClient(app) as client:
+        for _ in range(100):
+            response = client.get("/ready")
+            if response.status_code == 200:
+                break
+            time.sleep(0.05)
+        assert response.status_code == 200
+        assert response.json()["steps"]["mysql"] == "ok"
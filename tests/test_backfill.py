@@ -0,0 +1,79 @@
+import asyncio
+import marknote.backfill as backfill
+
+def test_checkpoint_advances_only_over_contiguous_ids(tmp_path):
+    checkpoint = backfill.Checkpoint(str(tmp_path / "checkpoint.json"))
+    for row_id in (1, 2, 3):
+        checkpoint.dispatch(row_id)
+    checkpoint.finish([2, 3])
+    assert checkpoint.last_id == 0
+    checkpoint.finish([1])
+    assert checkpoint.last_id == 3
+    checkpoint.save()
+    assert backfill.Checkpoint(str(tmp_path / "checkpoint.json")).last_id == 3
+
+def test_backfill_resumes_from_checkpoint(tmp_path, monkeypatch):
+    rows = [
+        {"id": i, "summary_id": "s1", "language": "zh", "content": f"[{i}-{i + 1}][张三] 内容{i}",
+         "mark_type": "time", "image_url": None, "user_notes": None}
+        for i in range(1, 6)
+    ]
+    def fake_iter(after_id, summary_id, limit, batch_size):
+        pending = [row for row in rows if row["id"] > after_id]
+        for idx in range(0, len(pending), batch_size):
+            yield pending[idx:idx + batch_size]
+    updates = []
+    monkeypatch.setattr(backfill, "iter_mark_note_summaries", fake_iter)
+    monkeypatch.setattr(backfill, "update_mark_note_summaries", lambda batch: updates.extend(batch))
+    monkeypatch.setattr(backfill, "call_llm_api", lambda prompt, *args: "new summary")
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    args = backfill.parse_args(["--checkpoint", checkpoint_path, "--processes", "1", "--concurrency", "2", "--batch-size", "2"])
+    checkpoint = asyncio.run(backfill.run_backfill(args))
+    assert checkpoint.last_id == 5
+    assert sorted(row_id for _, _, row_id in updates) == [1, 2, 3, 4, 5]
+    assert all(mark_note == "new summary" for mark_note, _, _ in updates)
+    assert "内容3" in [prompt for _, prompt, row_id in updates if row_id == 3][0]
+    updates.clear()
+    asyncio.run(backfill.run_backfill(args))
+    assert updates == []
+
+def test_retry_failed_reprocesses_only_failed_rows(tmp_path, monkeypatch):
+    rows = [
+        {"id": i, "summary_id": "s1", "language": "zh", "content": f"[{i}-{i + 1}][张三] 内容{i}",
+         "mark_type": "time", "image_url": None, "user_notes": None}
+        for i in range(1, 6)
+    ]
+    def fake_iter(after_id, summary_id, limit, batch_size):
+        pending = [row for row in rows if row["id"] > after_id]
+        for idx in range(0, len(pending), batch_size):
+            yield pending[idx:idx + batch_size]
+    def fake_llm(prompt, *args):
+        if "内容3" in prompt and failing:
+            raise RuntimeError("timeout")
+        return "new summary"
+    failing = True
+    updates = []
+    monkeypatch.setattr(backfill, "iter_mark_note_summaries", fake_iter)
+    monkeypatch.setattr(backfill, "get_mark_note_summaries_by_ids", lambda ids: [row for row in rows if row["id"] in ids])
+    monkeypatch.setattr(backfill, "update_mark_note_summaries", lambda batch: updates.extend(batch))
+    monkeypatch.setattr(backfill, "call_llm_api", fake_llm)
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    argv = ["--checkpoint", checkpoint_path, "--processes", "1", "--concurrency", "2", "--batch-size", "2"]
+    checkpoint = asyncio.run(backfill.run_backfill(backfill.parse_args(argv)))
+    assert checkpoint.last_id == 5
+    assert backfill.Checkpoint(checkpoint_path).failed_ids == [3]
+    assert sorted(row_id for _, _, row_id in updates) == [1, 2, 4, 5]
+    failing = False
+    updates.clear()
+    checkpoint = asyncio.run(backfill.run_backfill(backfill.parse_args(argv + ["--retry-failed"])))
+    assert [row_id for _, _, row_id in updates] == [3]
+    saved = backfill.Checkpoint(checkpoint_path)
+    assert (saved.last_id, saved.failed_ids) == (5, [])
+
+def test_parse_image_urls_keeps_data_urls_intact():
+    from marknote.mark_note import parse_image_urls
+    data_url = "data:image/png;base64,iVBORw0KGgo="
+    assert parse_image_urls('["https://a/x.png?size=1,2", "%s"]' % data_url) == ["https://a/x.png?size=1,2", data_url]
+    # 旧数据以逗号拼接
+    assert parse_image_urls(f"s3://bucket/a.png,{data_url},images/b.png") == ["s3://bucket/a.png", data_url, "images/b.png"]
+    assert parse_image_urls(None) == []
@@ -0,0 +1,43 @@
+import json
+import os
+import pytest
+import marknote.config as config
+
+@pytest.fixture(autouse=True)
+def reset_llm_settings(monkeypatch):
+    monkeypatch.setattr(config, "_llm_settings", None)
+    monkeypatch.setattr(config, "count_tokens", lambda text: len(text.split()))
+    monkeypatch.setenv("BASE_MODEL", "base")
+    monkeypatch.setenv("FAST_MODEL", "fast")
+    monkeypatch.setenv("SMALL_WINDOW_TOKENS", "5")
+    monkeypatch.delenv("LLM_ROUTING_FILE", raising=False)
+    yield
+    config._llm_settings = None
+
+def test_default_routes_by_site_and_tokens():
+    assert config.get_llm_config("meeting")["model"] == "base"
+    assert config.get_llm_config("meeting", "segment", tokens=100000)["model"] == "fast"
+    assert config.get_llm_config("meeting", "mark_summary", text="a b c")["model"] == "fast"
+    assert config.get_llm_config("meeting", "mark_summary", text="a b c d e f")["model"] == "base"
+    assert config.get_llm_config("meeting", "final", text="a")["model"] == "base"
+
+def test_routing_file_is_reloaded_when_modified(tmp_path, monkeypatch):
+    path = tmp_path / "routes.json"
+    path.write_text(json.dumps({"routes": [{"site": "final", "model": "big", "api_key_env": "BIG_KEY"}]}))
+    monkeypatch.setenv("LLM_ROUTING_FILE", str(path))
+    monkeypatch.setenv("LLM_CONFIG_CHECK_INTERVAL", "0")
+    monkeypatch.setenv("BIG_KEY", "secret")
+    cfg = config.get_llm_config("meeting", "final")
+    assert (cfg["model"], cfg["api_key"]) == ("big", "secret")
+    # 路由文件替换后 segment 不再命中默认的快模型规则
+    assert config.get_llm_config("meeting", "segment")["model"] == "base"
+    path.write_text(json.dumps({"routes": [{"site": "final", "model": "bigger"}]}))
+    os.utime(path, (0, 12345))
+    assert config.get_llm_config("meeting", "final")["model"] == "bigger"
+
+def test_unknown_route_site_is_rejected(tmp_path, monkeypatch):
+    path = tmp_path / "routes.json"
+    path.write_text(json.dumps({"routes": [{"site": "summary", "model": "x"}]}))
+    monkeypatch.setenv("LLM_ROUTING_FILE", str(path))
+    with pytest.raises(ValueError):
+        config.get_llm_config("meeting", "final")
@@ -0,0 +1,40 @@
+import json
+from fastapi.testclient import TestClient
+import marknote.extension as extension
+from marknote.usage import record_usage
+from main import app
+
+def test_pack_notes_respects_budget_and_sends_long_notes_alone(monkeypatch):
+    monkeypatch.setattr(extension, "count_tokens", lambda text, model_name: len(text.split()))
+    notes = [extension.ExtensionNote(note_id=str(i), user_note=text) for i, text in enumerate(["a b", "c d", "e f", "long " * 10, "g"])]
+    packs, singles = extension.pack_notes(notes, max_notes=2, max_tokens=100, note_max_tokens=5)
+    assert [[note.note_id for note in pack] for pack in packs] == [["0", "1"], ["2", "4"]]
+    assert [note.note_id for note in singles] == ["3"]
+
+def test_parse_batch_output_handles_fences_and_results_key():
+    assert extension.parse_batch_output('```json\n[{"id": "0", "extended_text": "x"}]\n```') == {"0": "x"}
+    assert extension.parse_batch_output('{"results": [{"id": 1, "extended_text": "y"}]}') == {"1": "y"}
+    assert extension.parse_batch_output("not json") == {}
+
+def test_batch_streams_results_and_falls_back_for_unmapped_notes(monkeypatch):
+    calls = []
+    def fake_llm(prompt, image_url, model, api_key, api_url):
+        calls.append(prompt)
+        record_usage({"prompt_tokens": 5, "completion_tokens": 1})
+        if "JSON array of id and note" in prompt:
+            # 只返回第一条笔记的结果，第二条需要单独补调
+            return '[{"id": "0", "extended_text": "packed 0"}]'
+        return "single"
+    monkeypatch.setattr(extension, "call_llm_api", fake_llm)
+    monkeypatch.setattr(extension, "count_tokens", lambda text, model_name: len(text.split()))
+    client = TestClient(app)
+    resp = client.post("/mark_note/extension/batch", json={"notes": [
+        {"note_id": "n1", "user_note": "跟进预算"},
+        {"note_id": "n2", "user_note": "发会议纪要"},
+    ]})
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    results = {item["note_id"]: item["extended_text"] for item in lines if "note_id" in item}
+    assert results == {"n1": "packed 0", "n2": "single"}
+    assert len(calls) == 2
+    assert lines[-1]["usage"]["calls"] == 2
@@ -0,0 +1,112 @@
+import os
+import time
+from fastapi.testclient import TestClient
+from main import app
+
+def test_batch_image_summary_is_cached(monkeypatch):
+    import marknote.images as images
+    calls = []
+    def fake_llm(prompt, image_url, model, api_key, api_url):
+        calls.append(image_url)
+        return f"description of {image_url[0]}"
+    monkeypatch.setattr(images, "call_llm_api", fake_llm)
+    monkeypatch.setattr(images, "_image_content_cache", images.TTLCache(16))
+    client = TestClient(app)
+    payload = {"image_urls": ["https://example.com/a.png", "https://example.com/b.png"], "language": "zh"}
+    data = client.post("/image/summary", json=payload).json()
+    assert [item["summary"] for item in data["summaries"]] == [
+        "description of https://example.com/a.png",
+        "description of https://example.com/b.png",
+    ]
+    client.post("/image/summary", json={"image_url": "https://example.com/a.png", "language": "zh"})
+    assert len(calls) == 2
+
+def test_image_mark_fills_image_content(monkeypatch):
+    import marknote.images as images
+    import marknote.mark_note as mark_note
+    monkeypatch.setattr(images, "call_llm_api", lambda prompt, image_url, *args: "白板上写着 Q3 目标 500 万")
+    monkeypatch.setattr(images, "_image_content_cache", images.TTLCache(16))
+    summary_calls = []
+    def fake_llm(prompt, image_url, model, api_key, api_url):
+        summary_calls.append((prompt, image_url))
+        return "summary"
+    monkeypatch.setattr(mark_note, "call_llm_api", fake_llm)
+    monkeypatch.setattr(mark_note, "insert_mark_note_summary", lambda data: None)
+    client = TestClient(app)
+    payload = {
+        "summary_id": "img123",
+        "scenario": "meeting",
+        "language": "zh",
+        "mark_time": 60,
+        "time_range": 30,
+        "content": "[0-60][张三] 这是会议内容1",
+        "mark_type": "image",
+        "image_url": ["https://example.com/whiteboard.png"]
+    }
+    data = client.post("/mark_note/summary", json=payload).json()
+    assert data["llm_summary"] == "summary"
+    prompt, image_url = summary_calls[0]
+    assert image_url is None
+    assert "白板上写着 Q3 目标 500 万" in prompt
+    assert "{{image_content}}" not in prompt
+
+def test_encode_image_matches_plain_base64(tmp_path):
+    import base64
+    import marknote.images as images
+    data = bytes(range(256)) * 1000
+    path = tmp_path / "image.png"
+    path.write_bytes(data)
+    expected = base64.b64encode(data).decode("utf-8")
+    assert images.encode_image(str(path)) == expected
+
+class FakeS3Client:
+    def __init__(self):
+        self.downloads = []
+        self.heads = []
+
+    def head_object(self, Bucket, Key):
+        self.heads.append((Bucket, Key))
+        return {"ETag": '"etag-1"'}
+
+    def download_file(self, bucket, key, path):
+        self.downloads.append((bucket, key))
+        with open(path, "wb") as f:
+            f.write(b"x" * 100)
+
+def test_fetch_image_from_s3_uses_local_cache(tmp_path, monkeypatch):
+    import marknote.images as images
+    client = FakeS3Client()
+    monkeypatch.setattr(images, "_s3_client", client)
+    images._s3_etag_cache.clear()
+    monkeypatch.setenv("S3_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("S3_CACHE_MAX_BYTES", "150")
+    first = images.fetch_image_from_s3("user-a/photo.jpg", "bucket")
+    assert images.fetch_image_from_s3("user-a/photo.jpg", "bucket") == first
+    # 刚使用过的文件即使超过上限也不淘汰
+    images.evict_local_cache(str(tmp_path), 50)
+    assert os.path.exists(first)
+    os.utime(first, (time.time() - 3600, time.time() - 3600))
+    other = images.fetch_image_from_s3("user-b/photo.jpg", "bucket")
+    assert other != first
+    assert len(client.downloads) == 2
+    # ETag 按 bucket/key 缓存，同一对象只 head 一次
+    assert client.heads == [("bucket", "user-a/photo.jpg"), ("bucket", "user-b/photo.jpg")]
+    # 超过缓存上限后最早的文件被淘汰
+    assert sorted(p.name for p in tmp_path.iterdir()) == [other.rsplit("/", 1)[-1]]
+
+def test_inline_delivery_refetches_evicted_file(tmp_path, monkeypatch):
+    import marknote.images as images
+    client = FakeS3Client()
+    monkeypatch.setattr(images, "_s3_client", client)
+    images._s3_etag_cache.clear()
+    monkeypatch.setenv("S3_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("S3_IMAGE_DELIVERY", "inline")
+    fetch = images.fetch_image_from_s3
+    def fetch_then_evict(key, bucket):
+        path = fetch(key, bucket)
+        if len(client.downloads) == 1:
+            os.remove(path)
+        return path
+    monkeypatch.setattr(images, "fetch_image_from_s3", fetch_then_evict)
+    assert images.resolve_image_url("s3://bucket/photo.jpg").startswith("data:image/jpeg;base64,eHh4")
+    assert len(client.downloads) == 2
@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 重量级依赖只允许在首次使用时导入
+LAZY_MODULES = {"tiktoken", "boto3", "botocore", "langchain", "langchain_core", "langchain_text_splitters"}
+IMPORT_TIME_BUDGET_MS = int(os.getenv("IMPORT_TIME_BUDGET_MS", 3000))
+
+def import_times(module: str) -> dict:
+    """用 python -X importtime 导入模块，返回 {模块名: 累计耗时(us)}"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_DIR, capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+def test_main_does_not_import_heavy_dependencies():
+    times = import_times("main")
+    loaded = {name.split(".")[0] for name in times}
+    assert not loaded & LAZY_MODULES
+
+def test_main_import_time_budget():
+    times = import_times("main")
+    assert times["main"] / 1000 < IMPORT_TIME_BUDGET_MS
@@ -0,0 +1,80 @@
+import time
+import pytest
+from fastapi.testclient import TestClient
+import marknote.live as live
+from main import app
+
+def lines(start, end, step=10):
+    return "\n".join(f"[{t}-{t + step - 1}][张三] 第{t}秒的内容" for t in range(start, end, step))
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    calls = []
+    def fake_llm(prompt, image_url, model, api_key, api_url):
+        calls.append(prompt)
+        return "incremental" if "Previous Summary" in prompt else f"window {len(calls)}"
+    monkeypatch.setattr(live, "call_llm_api", fake_llm)
+    monkeypatch.setattr(live, "save_usage", lambda *args: None)
+    monkeypatch.setattr("marknote.mark_note.call_llm_api", fake_llm)
+    monkeypatch.setattr("marknote.mark_note.insert_mark_note_summary", lambda data: None)
+    monkeypatch.setitem(live._live_cfg, "enabled", True)
+    monkeypatch.setitem(live._live_cfg, "workers", 1)
+    yield calls
+    live._sessions.clear()
+
+def wait_windows(client, summary_id, count):
+    for _ in range(100):
+        status = client.get(f"/live/{summary_id}").json()
+        if status["pending_windows"] == 0 and len(status["windows"]) >= count:
+            return status
+        time.sleep(0.02)
+    raise AssertionError(status)
+
+def mark(client, mark_time, time_range=30):
+    return client.post("/mark_note/summary", json={
+        "summary_id": "live1", "scenario": "meeting", "language": "zh",
+        "mark_time": mark_time, "time_range": time_range, "mark_type": "time",
+    }).json()
+
+def test_time_mark_is_served_from_precomputed_window(llm_calls):
+    client = TestClient(app)
+    scheduled = client.post("/live/live1/lines", json={"language": "zh", "content": lines(0, 100)}).json()["scheduled"]
+    assert [(w["start"], w["end"]) for w in scheduled] == [(0, 60), (30, 90)]
+    wait_windows(client, "live1", 2)
+    assert len(llm_calls) == 2
+    data = mark(client, 60)
+    assert data["live"] == {"window_start": 30, "window_end": 90, "incremental": False}
+    assert data["llm_summary"].startswith("window")
+    assert len(llm_calls) == 2
+
+def test_mark_past_window_end_is_built_incrementally(llm_calls):
+    client = TestClient(app)
+    client.post("/live/live1/lines", json={"language": "zh", "content": lines(0, 100)})
+    # 不足以凑满下一个窗口的新行只进入缓冲
+    assert client.post("/live/live1/lines", json={"language": "zh", "content": lines(100, 110)}).json()["scheduled"] == []
+    wait_windows(client, "live1", 2)
+    data = mark(client, 90)
+    assert data["live"] == {"window_start": 30, "window_end": 90, "incremental": True}
+    assert data["llm_summary"] == "incremental"
+    assert "第100秒的内容" in llm_calls[-1]
+    assert "第90秒的内容" not in llm_calls[-1]
+
+def test_live_mode_refuses_multiple_workers(llm_calls, monkeypatch):
+    monkeypatch.setitem(live._live_cfg, "workers", 4)
+    client = TestClient(app)
+    assert "WEB_CONCURRENCY=1" in client.post("/live/live1/lines", json={"language": "zh", "content": lines(0, 100)}).json()["error"]
+    assert live.summarize_from_live("live1", "zh", 30, 90) is None
+    assert llm_calls == []
+
+def test_mark_starting_before_windows_falls_back_to_full_summary(llm_calls):
+    client = TestClient(app)
+    client.post("/live/live1/lines", json={"language": "zh", "content": lines(40, 140)})
+    wait_windows(client, "live1", 2)
+    # 标记窗口 [0, 40] 与预摘要窗口 [30, 90] 重叠，但开头早于所有窗口
+    data = client.post("/mark_note/summary", json={
+        "summary_id": "live1", "scenario": "meeting", "language": "zh", "mark_time": 20, "time_range": 20,
+        "mark_type": "time", "content": lines(0, 40),
+    }).json()
+    assert "live" not in data
+    assert len(llm_calls) == 3
+    assert "第0秒的内容" in llm_calls[-1]
@@ -0,0 +1,128 @@
+import uuid
+import pytest
+import marknote.database.mysql_client as mysql_client
+
+class FakeConnection:
+    def __init__(self):
+        self.open = True
+        self.calls = []
+
+    def rollback(self):
+        self.calls.append("rollback")
+
+    def ping(self, reconnect=False):
+        self.calls.append("ping")
+
+    def close(self):
+        self.open = False
+
+def test_release_ends_transaction_before_reuse(monkeypatch):
+    conn = FakeConnection()
+    monkeypatch.setattr(mysql_client, "_connect", lambda: conn)
+    mysql_client.close_pool()
+    with mysql_client.get_connection():
+        pass
+    assert conn.calls == ["rollback"]
+    with mysql_client.get_connection() as reused:
+        assert reused is conn
+    mysql_client.close_pool()
+
+@pytest.fixture
+def mysql_pool():
+    try:
+        mysql_client.init_db()
+    except Exception as e:
+        pytest.skip(f"MySQL unavailable: {e}")
+    yield
+    mysql_client.close_pool()
+
+def test_pooled_connection_sees_rows_committed_by_another(mysql_pool):
+    summary_id = "pool-" + uuid.uuid4().hex
+    # 先占用两个连接并在其中一个上开始读事务，归还后再由另一个连接写入
+    with mysql_client.get_connection() as reader, mysql_client.get_connection() as writer:
+        assert mysql_client.get_mark_note_summaries(summary_id) == []
+        with reader.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM mark_note_summary WHERE summary_id = %s", (summary_id,))
+    mysql_client.insert_mark_note_summary({
+        "summary_id": summary_id, "scenario": "meeting", "language": "zh", "mark_time": 10, "time_range": 5,
+        "content": "c", "prompt": "p", "mark_type": "time", "image_url": None, "user_notes": None,
+        "mark_note": "n", "start_time": 5, "end_time": 15,
+    })
+    with mysql_client.get_connection() as reader:
+        with reader.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM mark_note_summary WHERE summary_id = %s", (summary_id,))
+            assert cursor.fetchone()[0] == 1
+        with reader.cursor() as cursor:
+            cursor.execute("DELETE FROM mark_note_summary WHERE summary_id = %s", (summary_id,))
+        reader.commit()
+
+class FakeCursor:
+    def __init__(self, columns, indexes):
+        self.results = {"COLUMNS": [(name,) for name in columns], "STATISTICS": [(name,) for name in indexes]}
+        self.executed = []
+        self.rows = []
+
+    def execute(self, sql, args=None):
+        self.executed.append(" ".join(sql.split()))
+        self.rows = next((rows for table, rows in self.results.items() if f"information_schema.{table}" in sql), [])
+
+    def fetchall(self):
+        return self.rows
+
+def test_migration_adds_only_missing_column_and_index():
+    cursor = FakeCursor(["id", "summary_id", "content", "start_time"], ["PRIMARY"])
+    mysql_client.migrate_table(cursor, "mark_note_summary")
+    alters = [sql for sql in cursor.executed if sql.startswith("ALTER")]
+    assert alters == [
+        "ALTER TABLE mark_note_summary ADD COLUMN prompt TEXT AFTER content",
+        "ALTER TABLE mark_note_summary ADD INDEX idx_summary_id_start_time (summary_id, start_time)",
+    ]
+    cursor = FakeCursor(["id", "summary_id", "content", "prompt", "start_time"], ["PRIMARY", "idx_summary_id_start_time"])
+    mysql_client.migrate_table(cursor, "mark_note_summary")
+    assert not [sql for sql in cursor.executed if sql.startswith("ALTER")]
+    cursor = FakeCursor(["id", "summary_id", "calls", "prompt_tokens"], ["PRIMARY", "idx_summary_id"])
+    mysql_client.migrate_table(cursor, "llm_usage")
+    assert [sql for sql in cursor.executed if sql.startswith("ALTER")] == [
+        "ALTER TABLE llm_usage ADD COLUMN shared_calls INT DEFAULT 0 AFTER calls"
+    ]
+
+class KeysetConnection(FakeConnection):
+    def __init__(self, rows, queries):
+        super().__init__()
+        self.rows = rows
+        self.queries = queries
+
+    def cursor(self, cursor_class=None):
+        return KeysetCursor(self)
+
+class KeysetCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params):
+        after_id, size = params[0], params[-1]
+        self.conn.queries.append((after_id, size))
+        self.result = [row for row in self.conn.rows if row["id"] > after_id][:size]
+
+    def fetchall(self):
+        return self.result
+
+def test_iter_mark_note_summaries_uses_keyset_batches(monkeypatch):
+    rows = [{"id": i} for i in (2, 3, 5, 8, 9)]
+    queries = []
+    monkeypatch.setattr(mysql_client, "_connect", lambda: KeysetConnection(rows, queries))
+    mysql_client.close_pool()
+    batches = list(mysql_client.iter_mark_note_summaries(after_id=2, batch_size=2))
+    assert [[row["id"] for row in batch] for batch in batches] == [[3, 5], [8, 9]]
+    assert queries == [(2, 2), (5, 2), (9, 2)]
+    queries.clear()
+    assert [row["id"] for batch in mysql_client.iter_mark_note_summaries(limit=3, batch_size=2) for row in batch] == [2, 3, 5]
+    assert queries == [(0, 2), (3, 1)]
+    mysql_client.close_pool()
@@ -0,0 +1,85 @@
+import marshal
+import pytest
+from fastapi.testclient import TestClient
+import marknote.profiling as profiling
+from main import app
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setitem(profiling._profile_cfg, "enabled", True)
+    monkeypatch.setitem(profiling._profile_cfg, "dir", str(tmp_path))
+    monkeypatch.setitem(profiling._profile_cfg, "max_files", 2)
+    monkeypatch.setitem(profiling._profile_cfg, "top", 1000)
+    monkeypatch.setattr(profiling, "default_profiler", lambda: "cprofile")
+    monkeypatch.setattr("marknote.extension.call_llm_api", lambda prompt, *args: "扩写结果")
+    return tmp_path
+
+def test_header_triggers_cpu_and_memory_profile_of_sync_endpoint(profile_dir, admin_headers):
+    client = TestClient(app, headers=admin_headers)
+    resp = client.post("/mark_note/extension", json={"user_note": "笔记"}, headers={"X-Profile": "cprofile,memory"})
+    profile_id = resp.headers["x-profile-id"]
+    detail = client.get(f"/admin/profiles/{profile_id}").json()
+    assert detail["status"] == 200
+    # CPU 剖析在线程池中执行的接口函数内完成，能看到业务函数
+    assert "extend_note" in detail["cpu"]
+    assert detail["memory"]["peak_bytes"] > 0
+    raw = client.get(f"/admin/profiles/{profile_id}/download").content
+    assert isinstance(marshal.loads(raw), dict)
+
+def test_requests_without_header_are_not_profiled_and_retention_is_applied(profile_dir, admin_headers):
+    client = TestClient(app, headers=admin_headers)
+    assert "x-profile-id" not in client.post("/mark_note/extension", json={"user_note": "笔记"}).headers
+    for _ in range(3):
+        client.post("/mark_note/extension", json={"user_note": "笔记"}, headers={"X-Profile": "1"})
+    assert len(client.get("/admin/profiles").json()["profiles"]) == 2
+    assert len(list(profile_dir.glob("*.prof"))) == 2
+
+def test_parse_profile_header():
+    assert profiling.parse_profile_header("memory") == (None, True)
+    assert profiling.parse_profile_header("cprofile") == ("cprofile", False)
+    for value in ("0", "false", "OFF", "no", "", " "):
+        assert profiling.parse_profile_header(value) == (None, False)
+
+def test_disabled_header_value_is_not_profiled(profile_dir, admin_headers):
+    client = TestClient(app, headers=admin_headers)
+    resp = client.post("/mark_note/extension", json={"user_note": "笔记"}, headers={"X-Profile": "0"})
+    assert "x-profile-id" not in resp.headers
+    assert client.get("/admin/profiles").json()["profiles"] == []
+
+def test_busy_or_failing_cpu_profiler_only_drops_cpu_profile(profile_dir, monkeypatch, admin_headers):
+    client = TestClient(app, headers=admin_headers)
+    with profiling._cpu_profile_lock:
+        resp = client.post("/mark_note/extension", json={"user_note": "笔记"}, headers={"X-Profile": "cprofile"})
+    assert resp.json()["extended_text"] == "扩写结果"
+    assert client.get(f"/admin/profiles/{resp.headers['x-profile-id']}").json()["cpu"] is None
+
+    def fail_start(self):
+        raise ValueError("Another profiling tool is already active")
+    monkeypatch.setattr(profiling.CpuProfiler, "start", fail_start)
+    resp = client.post("/mark_note/extension", json={"user_note": "笔记"}, headers={"X-Profile": "cprofile"})
+    assert resp.json()["extended_text"] == "扩写结果"
+    assert not profiling._cpu_profile_lock.locked()
+
+def test_profile_header_requires_admin_token(profile_dir, monkeypatch):
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    resp = TestClient(app).post("/mark_note/extension", json={"user_note": "笔记"}, headers={"X-Profile": "1"})
+    assert "x-profile-id" not in resp.headers
+
+def test_memory_snapshots_run_off_the_event_loop(profile_dir, monkeypatch, admin_headers):
+    import asyncio
+    threads = []
+    def off_loop(fn):
+        def wrapper(*args):
+            try:
+                asyncio.get_running_loop()
+                threads.append("event loop")
+            except RuntimeError:
+                threads.append("worker thread")
+            return fn(*args)
+        return wrapper
+    monkeypatch.setattr(profiling, "start_tracemalloc", off_loop(profiling.start_tracemalloc))
+    monkeypatch.setattr(profiling, "stop_tracemalloc", off_loop(profiling.stop_tracemalloc))
+    client = TestClient(app, headers=admin_headers)
+    resp = client.post("/mark_note/extension", json={"user_note": "笔记"}, headers={"X-Profile": "memory"})
+    assert client.get(f"/admin/profiles/{resp.headers['x-profile-id']}").json()["memory"]["peak_bytes"] > 0
+    assert threads == ["worker thread", "worker thread"]
@@ -0,0 +1,51 @@
+import pytest
+from fastapi.testclient import TestClient
+import marknote.prompts as prompts
+from main import app
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    (tmp_path / "weekly").mkdir()
+    (tmp_path / "weekly" / "1.txt").write_text("v1 {{user_note}}", encoding="utf-8")
+    (tmp_path / "weekly" / "2.txt").write_text("v2 {{user_note}}", encoding="utf-8")
+    monkeypatch.setenv("PROMPT_DIR", str(tmp_path))
+    monkeypatch.setenv("PROMPT_DB_ENABLED", "false")
+    monkeypatch.setattr(prompts, "_registry", None)
+    yield prompts.get_prompt_registry()
+    prompts._registry = None
+
+def test_render_is_single_pass_and_fills_missing_with_empty():
+    template = prompts.PromptTemplate("{{meeting_content}} / {{language}} / {{user_notes}}")
+    assert template.render(meeting_content="说到 {{language}}", language="zh") == "说到 {{language}} / zh / "
+
+def test_compile_prompt_validates_and_caches():
+    text = "总结: {{meeting_content}} {{language}}"
+    assert prompts.compile_prompt(text, ("meeting_content", "language")) is prompts.compile_prompt(text, ("meeting_content", "language"))
+    with pytest.raises(ValueError):
+        prompts.compile_prompt("no placeholders", ("meeting_content", "language"))
+
+def test_registry_resolves_versions_and_builtin_names(registry):
+    assert registry.get("weekly").text == "v2 {{user_note}}"
+    assert registry.get("weekly:1").text == "v1 {{user_note}}"
+    assert registry.get("MEETING_SUMMARY_PROMPT_V4") is registry.get("MEETING_SUMMARY_PROMPT:4")
+    with pytest.raises(KeyError):
+        registry.get("weekly:3")
+
+def test_extension_uses_prompt_id(registry, monkeypatch, admin_headers):
+    calls = []
+    monkeypatch.setattr("marknote.extension.call_llm_api", lambda prompt, *args: calls.append(prompt) or "ok")
+    client = TestClient(app)
+    data = client.post("/mark_note/extension", json={"user_note": "笔记", "prompt_id": "weekly:1"}).json()
+    assert data["extended_text"] == "ok"
+    assert calls == ["v1 笔记"]
+    assert "error" in client.post("/mark_note/extension", json={"user_note": "笔记", "prompt_id": "missing"}).json()
+    listed = client.get("/admin/prompts", headers=admin_headers).json()["prompts"]
+    assert {"weekly:1", "weekly:2"} <= {item["prompt_id"] for item in listed}
+
+def test_create_prompt_is_rejected_when_db_prompts_are_disabled(registry, monkeypatch, admin_headers):
+    saved = []
+    monkeypatch.setattr("marknote.admin.insert_prompt_template", lambda *args: saved.append(args) or 1)
+    client = TestClient(app)
+    response = client.post("/admin/prompts", json={"name": "weekly", "template": "v3 {{user_note}}"}, headers=admin_headers)
+    assert response.status_code == 409
+    assert saved == []
@@ -0,0 +1,86 @@
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+from marknote.singleflight import SingleFlight
+from main import app
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+    def fn():
+        calls.append(1)
+        time.sleep(0.1)
+        return "result"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", fn))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert results == ["result"] * 5
+
+def test_error_is_shared_and_not_cached():
+    flight = SingleFlight()
+    def fail():
+        raise ValueError("boom")
+    with pytest.raises(ValueError):
+        flight.do("k", fail)
+    assert flight.do("k", lambda: "ok") == "ok"
+
+def test_idempotency_key_replays_stored_result(monkeypatch):
+    import marknote.mark_note as mark_note
+    calls = []
+    def fake_llm(prompt, image_url, model, api_key, api_url):
+        calls.append(prompt)
+        return "summary"
+    monkeypatch.setattr(mark_note, "call_llm_api", fake_llm)
+    monkeypatch.setattr(mark_note, "insert_mark_note_summary", lambda data: None)
+    client = TestClient(app)
+    payload = {
+        "summary_id": "idem123",
+        "scenario": "meeting",
+        "language": "zh",
+        "mark_time": 60,
+        "time_range": 30,
+        "content": "[0-60][张三] 这是会议内容1",
+        "mark_type": "time"
+    }
+    headers = {"Idempotency-Key": "retry-1"}
+    first = client.post("/mark_note/summary", json=payload, headers=headers).json()
+    second = client.post("/mark_note/summary", json=payload, headers=headers).json()
+    assert len(calls) == 1
+    assert first["llm_summary"] == second["llm_summary"] == "summary"
+    # 重放返回首次执行的用量
+    assert second["usage"] == first["usage"]
+    changed = client.post("/mark_note/summary", json={**payload, "mark_time": 90}, headers=headers)
+    assert changed.status_code == 422
+    assert "error" in changed.json()
+    assert len(calls) == 1
+
+def test_idempotency_result_is_shared_across_workers(monkeypatch):
+    import marknote.mark_note as mark_note
+    import marknote.singleflight as singleflight
+    store = {}
+    monkeypatch.setattr(singleflight, "get_idempotency_result", lambda scope, key: store.get((scope, key)))
+    monkeypatch.setattr(singleflight, "insert_idempotency_result",
+                        lambda scope, key, body_hash, result, ttl: store.setdefault((scope, key), {"body_hash": body_hash, "result": result}))
+    monkeypatch.setitem(singleflight._idempotency_cfg, "db_enabled", True)
+    calls = []
+    monkeypatch.setattr(mark_note, "call_llm_api", lambda prompt, *args: calls.append(prompt) or "summary")
+    monkeypatch.setattr(mark_note, "insert_mark_note_summary", lambda data: None)
+    client = TestClient(app)
+    payload = {
+        "summary_id": "idem-shared", "scenario": "meeting", "language": "zh", "mark_time": 60, "time_range": 30,
+        "content": "[0-60][张三] 这是会议内容1", "mark_type": "time",
+    }
+    headers = {"Idempotency-Key": "retry-other-worker"}
+    first = client.post("/mark_note/summary", json=payload, headers=headers).json()
+    # 重试落到另一个 worker: 进程内缓存为空，只能从共享存储读取
+    singleflight._idempotency_results.clear()
+    second = client.post("/mark_note/summary", json=payload, headers=headers).json()
+    assert len(calls) == 1
+    assert second == first
+    singleflight._idempotency_results.clear()
+    assert client.post("/mark_note/summary", json={**payload, "mark_time": 90}, headers=headers).status_code == 422
@@ -0,0 +1,80 @@
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+
+SRT = """1
+00:00:00,000 --> 00:00:04,500
+张三: 这是会议内容1
+
+2
+00:01:01,000 --> 00:01:05,000
+这是会议内容2
+"""
+
+VTT = """WEBVTT
+
+NOTE 注释块
+
+intro
+00:00.000 --> 00:04.500 align:start
+<v 张三>这是会议内容1</v>
+
+01:01.000 --> 01:05.000
+<v 李四>这是会议内容2
+"""
+
+JSONL = """{"start_time": 0, "end_time": 5, "speaker": "张三", "content": "这是会议内容1"}
+{"start_time": 61, "end_time": 65, "speaker": "李四", "content": "这是会议内容2"}
+"""
+
+BRACKET = "[0-5][张三] 这是会议内容1\r\n[61-65][李四] 这是会议内容2"
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv("TRANSCRIPT_DIR", str(tmp_path))
+    return TestClient(app)
+
+@pytest.mark.parametrize("fmt, body", [("srt", SRT), ("vtt", VTT), ("jsonl", JSONL), ("bracket", BRACKET)])
+def test_ingest_transcript_formats(client, fmt, body):
+    data = client.post(f"/transcript?format={fmt}", content=body.encode("utf-8")).json()
+    assert data["lines"] == 2
+    assert data["start_time"] == 0
+    assert data["end_time"] == 65
+
+def test_format_detected_from_content_type(client):
+    data = client.post("/transcript", content=VTT.encode("utf-8"), headers={"Content-Type": "text/vtt"}).json()
+    assert data["format"] == "vtt"
+    assert data["lines"] == 2
+
+def test_summary_by_transcript_id(client, monkeypatch):
+    import marknote.mark_note as mark_note
+    prompts = []
+    def fake_llm(prompt, image_url, model, api_key, api_url):
+        prompts.append(prompt)
+        return "summary"
+    monkeypatch.setattr(mark_note, "call_llm_api", fake_llm)
+    monkeypatch.setattr(mark_note, "insert_mark_note_summary", lambda data: None)
+    transcript_id = client.post("/transcript?format=vtt", content=VTT.encode("utf-8")).json()["transcript_id"]
+    payload = {
+        "summary_id": "tr123",
+        "scenario": "meeting",
+        "language": "zh",
+        "mark_time": 0,
+        "time_range": 30,
+        "transcript_id": transcript_id,
+        "mark_type": "time"
+    }
+    data = client.post("/mark_note/summary", json=payload).json()
+    assert data["llm_summary"] == "summary"
+    assert "张三: 这是会议内容1" in prompts[0]
+    assert "这是会议内容2" not in prompts[0]
+
+def test_delete_transcript(client):
+    transcript_id = client.post("/transcript", content=BRACKET.encode("utf-8")).json()["transcript_id"]
+    assert client.delete(f"/transcript/{transcript_id}").json() == {"deleted": transcript_id}
+    assert "error" in client.delete(f"/transcript/{transcript_id}").json()
+
+def test_jsonl_lines_with_non_string_fields_are_skipped(client):
+    body = JSONL + '{"start": 1, "end": 2, "content": 5}\n{"start": 3, "end": 4, "speaker": 7, "text": "x"}\n[1, 2]\n'
+    data = client.post("/transcript?format=jsonl", content=body.encode("utf-8")).json()
+    assert data["lines"] == 2
@@ -0,0 +1,87 @@
+from fastapi.testclient import TestClient
+from marknote.usage import record_usage
+from main import app
+
+FULL_TEXT = "\n".join(f"[{i * 10}-{i * 10 + 9}][张三] " + "内容 " * 40 for i in range(6))
+
+def fake_llm(prompt, image_url, model, api_key, api_url):
+    record_usage({"prompt_tokens": 10, "completion_tokens": 2})
+    return "summary"
+
+def setup_full_text(monkeypatch):
+    import marknote.full_text as full_text
+    saved = []
+    monkeypatch.setattr(full_text, "call_llm_api", fake_llm)
+    monkeypatch.setattr(full_text, "count_tokens", lambda text, model_name: len(text.split()))
+    monkeypatch.setattr(full_text, "SEGMENT_MAX_TOKENS_LEVELS", [50, 100, 400])
+    monkeypatch.setattr("marknote.usage.insert_llm_usage", saved.append)
+    return saved
+
+def test_full_text_usage_is_aggregated_and_stored(monkeypatch):
+    saved = setup_full_text(monkeypatch)
+    client = TestClient(app)
+    data = client.post("/mark_note/full_text", json={"summary_id": "u1", "full_text": FULL_TEXT, "mark_notes": []}).json()
+    # 6 个片段各一次 map 调用 + 1 次最终汇总
+    assert data["usage"]["calls"] == 7
+    assert data["usage"]["prompt_tokens"] == 70
+    assert data["usage"]["completion_tokens"] == 14
+    assert data["usage"]["estimated_tokens"] > 0
+    assert saved[0]["summary_id"] == "u1"
+    assert saved[0]["endpoint"] == "full_text"
+    assert saved[0]["calls"] == 7
+
+def test_full_text_degrades_to_coarser_segments_under_budget(monkeypatch):
+    setup_full_text(monkeypatch)
+    client = TestClient(app)
+    unbounded = client.post("/mark_note/full_text", json={"full_text": FULL_TEXT, "mark_notes": []}).json()
+    budget = unbounded["budget"]["estimated_tokens"] - 1
+    data = client.post("/mark_note/full_text", json={"full_text": FULL_TEXT, "mark_notes": [], "max_tokens_budget": budget}).json()
+    assert data["budget"]["degraded"] == "coarse_segments"
+    assert data["budget"]["estimated_tokens"] <= budget
+    assert data["usage"]["calls"] < unbounded["usage"]["calls"]
+
+def test_full_text_rejects_when_budget_cannot_be_met(monkeypatch):
+    setup_full_text(monkeypatch)
+    client = TestClient(app)
+    data = client.post("/mark_note/full_text", json={"full_text": FULL_TEXT, "mark_notes": [], "max_tokens_budget": 10}).json()
+    assert "error" in data
+    assert data["budget"]["degraded"] == "notes_only"
+    assert data["usage"]["calls"] == 0
+
+def test_full_text_rejects_notes_only_without_any_notes(monkeypatch):
+    setup_full_text(monkeypatch)
+    monkeypatch.setattr("marknote.full_text.SEGMENT_MAX_TOKENS_LEVELS", [400])
+    client = TestClient(app)
+    unbounded = client.post("/mark_note/full_text", json={"full_text": FULL_TEXT, "mark_notes": []}).json()
+    # 预算足够 reduce 阶段的固定开销，但不足以容纳任何分段; 没有笔记时不能降级为空内容的汇总
+    budget = unbounded["budget"]["estimated_tokens"] - 1
+    data = client.post("/mark_note/full_text", json={"full_text": FULL_TEXT, "mark_notes": [], "max_tokens_budget": budget}).json()
+    assert "error" in data
+    assert data["budget"]["degraded"] == "notes_only"
+    assert data["budget"]["estimated_tokens"] > budget
+    assert data["usage"]["calls"] == 0
+
+def test_shared_llm_call_tokens_are_counted_once(monkeypatch):
+    import threading
+    import time
+    import marknote.api as api
+    from marknote.usage import track_usage
+    posts = []
+    def slow_post(*args):
+        posts.append(args)
+        time.sleep(0.1)
+        return "shared", {"prompt_tokens": 10, "completion_tokens": 2}
+    monkeypatch.setattr(api, "_post_llm_api", slow_post)
+    usages = []
+    def request():
+        with track_usage() as tracker:
+            assert api.call_llm_api("same prompt", None, "model", "key", "http://llm") == "shared"
+        usages.append(tracker.to_dict())
+    threads = [threading.Thread(target=request) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(posts) == 1
+    # token 只计入发起调用的请求，其余请求记为共享调用，汇总时不重复计费
+    assert sorted((usage["calls"], usage["shared_calls"], usage["prompt_tokens"]) for usage in usages) == [(0, 1, 0), (0, 1, 0), (1, 0, 10)]